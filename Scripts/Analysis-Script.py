@@ -8,6 +8,11 @@ established to analyse the output of the Light/Dark transition test.
 It applies hierarchical clustering and visualizes the results to allow for
 interpretation. The script operates on the output of the filtering (third)
  script.
+Its functions can be imported (see ldt_tools.load_script); matplotlib,
+seaborn and scipy are only imported when they are used first. With --worker
+the script keeps running and answers clustering requests (one JSON object
+per line on stdin), keeping the loaded dataframes and the distances between
+the fish in memory for the next requests.
 
 It was developed at the Computational Ecology working group,
 Institute for Environmental Research, Biology V, RWTH Aachen.
@@ -15,23 +20,58 @@ Institute for Environmental Research, Biology V, RWTH Aachen.
 For questions please contact: dominik.ziaja@rwth-aachen.de
 """
 
-import matplotlib as mlb
 import pathlib
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns; sns.set()
-from scipy.cluster import hierarchy
 import re
-import matplotlib.patches as mpatches
 import os
+import argparse
+import contextlib
+import functools
+import json
+import sys
+import time
+import ldt_io
+import ldt_profiling
+import ldt_store
+import ldt_tools
+
+# matplotlib, seaborn and scipy take most of the startup time, thus they are
+# imported by load_plotting and load_scipy when they are needed first
+mlb = None
+plt = None
+sns = None
+mpatches = None
+hierarchy = None
+distance = None
+
+# amount of dataframes (and of distance matrices) the worker keeps in memory
+CACHE_SIZE = 8
+
+
+def load_plotting():
+    global mlb, plt, sns, mpatches
+    if sns is None:
+        import matplotlib as mlb
+        import matplotlib.pyplot as plt
+        import matplotlib.patches as mpatches
+        import seaborn as sns
+        sns.set()
+
+
+def load_scipy():
+    global hierarchy, distance
+    if hierarchy is None:
+        from scipy.cluster import hierarchy
+        from scipy.spatial import distance
 
 
 def get_file_paths(folderpath):
     # append all csv-files in the directory containing (un)rolled in their name
+    # and the feature matrix of the feature script
     path_list = [item for item in
-                 pathlib.Path(folderpath).glob('*.csv')
-                 if re.search('_moving_', item.name)]
+                 ldt_io.glob_csv(folderpath)
+                 if re.search('_moving_|_features', item.name)]
 
     return path_list
 
@@ -76,6 +116,17 @@ def get_treatments_and_replace(df):
     return IDs
 
 
+# the features are measured in different units (mm, s, counts), thus each
+# feature is scaled to a mean of 0 and a standard deviation of 1 before
+# clustering. Features without any variation are dropped
+def standardize_features(df):
+    std = df.std(axis=0)
+    df = df.loc[:, std > 0]
+    df = (df - df.mean(axis=0)) / std[std > 0]
+
+    return df
+
+
 # ask the user for an input of the amount of clusters he would like to receive
 def get_amount_cluster():
     n = input("Please type in how many Clusters you would"
@@ -94,7 +145,11 @@ def get_amount_cluster():
         get_amount_cluster()
 
 
-def calculate_hierarchy_linkage(df, amount_cluster):
+# distances optionally contains the distances between all fish of df
+# (see load_distances), so they aren't calculated again for every linkage
+def calculate_hierarchy_linkage(df, amount_cluster, distances=None,
+                                metric='euclidean', method='complete'):
+    load_scipy()
     df_cluster = df.copy()
     counter = 0
     # list for checking the condition whether there are still 1-fish-cluster
@@ -106,9 +161,19 @@ def calculate_hierarchy_linkage(df, amount_cluster):
         # calculate the linkage method metrics and values,
         # cut them at the wished amount of cluster
         # and save them into a pd.Series-format
-        link = hierarchy.linkage(df_cluster,
-                                 metric='euclidean',
-                                 method='complete')
+        with ldt_profiling.step('hierarchy.linkage', rows=len(df_cluster)):
+            if distances is None:
+                link = hierarchy.linkage(df_cluster,
+                                         metric=metric,
+                                         method=method)
+            else:
+                # the condensed distances between the remaining fish
+                link = hierarchy.linkage(
+                    distance.squareform(
+                        distances.loc[df_cluster.index,
+                                      df_cluster.index].to_numpy(),
+                        checks=False),
+                    method=method)
         cut_tree = hierarchy.cut_tree(link, amount_cluster)
         cut_tree = np.squeeze(cut_tree)
         Cluster_series = pd.Series(cut_tree, index=df_cluster.index)
@@ -136,7 +201,7 @@ def calculate_hierarchy_linkage(df, amount_cluster):
 
 # for the seaborn clustermap, colors which indicate the treatment
 # next to the heatmap
-def create_row_colors(colors_to_zip, df):
+def create_row_colors(colors_to_zip, IDs, df):
     # Make a dictionary out of the ID and color
     zipped_IDs_and_colors = zip(np.unique(IDs), colors_to_zip)
     color_dictionary = dict(zipped_IDs_and_colors)
@@ -146,7 +211,9 @@ def create_row_colors(colors_to_zip, df):
     return row_colors, color_dictionary
 
 
-def plot_clustermap(df, linkage, row_colors, color_dictionary, fig_title):
+def plot_clustermap(df, linkage, row_colors, color_dictionary, fig_title,
+                    folder='.'):
+    load_plotting()
     # plot the clustermap with the linkage precalculated
     # don't cluster the columns
     fig = sns.clustermap(df, row_linkage=linkage, col_cluster=False,
@@ -169,10 +236,15 @@ def plot_clustermap(df, linkage, row_colors, color_dictionary, fig_title):
     # define the title of the whole plot
     fig.fig.suptitle(f'Clustermap {fig_title}', x=0.6, fontsize=60)
     # then save the figure
-    fig.savefig(fr'clustermap_{fig_title}.png', dpi=300)
+    fig.savefig(pathlib.Path(folder) / f'clustermap_{fig_title}.png',
+                dpi=300)
 
 
-def plot_clusters(df, Cluster_series, fig_title):
+def plot_clusters(df, Cluster_series, fig_title, folder='.'):
+    load_plotting()
+    # the columns of the feature matrix are features, not time points
+    features = pd.to_numeric(pd.Series(df.columns),
+                             errors='coerce').isna().any()
     # iterate over every cluster
     for cluster in Cluster_series['Cluster'].unique():
         print(f"Starting with cluster {cluster}.")
@@ -186,7 +258,8 @@ def plot_clusters(df, Cluster_series, fig_title):
         for idx, (ID, fish) in enumerate(subset_cluster.iterrows()):
             fish.reset_index(inplace=True, drop=True)
             if idx == 0:
-                ax.plot(pd.Series(fish), color='blue', label='Time series')
+                ax.plot(pd.Series(fish), color='blue',
+                        label='Fish' if features else 'Time series')
             # and plot it
             else:
                 ax.plot(pd.Series(fish), color='blue')
@@ -196,16 +269,26 @@ def plot_clusters(df, Cluster_series, fig_title):
         ax.plot(mean, color='red', label='Mean')
         # set axis properties:
         # xaxis and yaxis limits
-        ax.set(xlim=(0), ylim=(0, df.max().max() + (1/10 * df.mean().mean())),
+        # (standardized features may be negative)
+        ax.set(xlim=(0), ylim=(min(0, df.min().min()),
+                               df.max().max() + (1/10 * df.mean().mean())),
                # figure title with filter applied, amount of fish and cluster
                title=(f"{fig_title.capitalize()}, "
                       f"n={len(subset_cluster.index)}, "
                       f"Cluster: {cluster}"),
-               ylabel=f"{fig_title} [mm]",
-               xlabel="Trial time")
-        ax.set_xticklabels([])
+               ylabel=(f"{fig_title} (standardized)" if features
+                       else f"{fig_title} [mm]"),
+               xlabel="Feature" if features else "Trial time")
+        if features:
+            ax.set_xticks(np.arange(len(df.columns)))
+            ax.set_xticklabels(df.columns, rotation=90, fontsize=5)
+            # make room for the feature names
+            fig.tight_layout()
+        else:
+            ax.set_xticklabels([])
         ax.legend(loc='upper right')
-        fig.savefig(f"Plot_{fig_title}_Cluster{cluster}.png",
+        fig.savefig(pathlib.Path(folder)
+                    / f"Plot_{fig_title}_Cluster{cluster}.png",
                     dpi=300)
 
 
@@ -218,6 +301,7 @@ def autolabel_bar(rectangle, ax, cluster_series, stacked_height):
 
 
 def plot_stacked_barplot(Cluster_series, crosstab, fig_title):
+    load_plotting()
     # initialize a series that keeps track
     # of the barplot height in each iteration to stack it
     stacked_height = pd.Series(np.zeros(len(crosstab.index)))
@@ -276,61 +360,286 @@ def create_barplot_fig_title(fig_title):
     return barplot_fig_title
 
 
-# Set the scripts location as working directory
-script_location = os.path.dirname(os.path.abspath(__file__))
-os.chdir(script_location)
-path_list = get_file_paths(os.getcwd())
-# depending on whether its the rolling mean/stddev the figure-title is defined
-for path in path_list:
-    if 'mean' in path.name.lower():
-        fig_title = 'moving average'
-    elif 'stddev' in path.name.lower():
-        fig_title = 'moving standard deviation'
-# read in the file
-print(f"loading in file: {path.name}.")
-df = pd.read_csv(path, sep=',', header=0, index_col=0)
-# drop all na-values
-df.dropna(inplace=True, axis=1)
-# calculate the linkage and get the
-# list of outliers, the linkage and the clusters
-print(f"Calculating the linkage.")
-Cluster_series, outlier_list, recursive_linkage = (
-    calculate_hierarchy_linkage(df, get_amount_cluster())
-    )
-# drop the outliers from the original dataframe before continuing visualization
-df.drop(outlier_list, axis=0, inplace=True)
-# get treatment info from the IDs (e.g. 97_EtOH3_96hpf_2 becomes EtOH3-96hpf)
-IDs = get_treatments_and_replace(df)
-# colors which should be used for the row_colors
-# need to match the amount of unique treatments
-colors_to_zip = ['orange', 'yellow', 'black', 'springgreen',
-                 'darkgreen', 'olive', 'deepskyblue', 'blue',
-                 'rosybrown', 'red', 'darkviolet']
-
-row_colors, color_dictionary = create_row_colors(colors_to_zip, df)
-print(f"Plotting and saving the clustermap.")
-plot_clustermap(df, recursive_linkage, row_colors, color_dictionary, fig_title)
-# format the Cluster-assignment dataseries
-Cluster_series.sort_values(inplace=True)
-Cluster_series = Cluster_series.to_frame('Cluster')
-print("Saving the Clustering results as csv file.")
-Cluster_series.to_csv(f"{fig_title}_HClustering_results.csv",
-                      sep=',',
-                      header=True)
-print("Plotting and saving every cluster.")
-plot_clusters(df, Cluster_series, fig_title)
-# Get the IDs with "neg control" again for the sorted Cluster_series dataframe
-IDs = get_treatments_and_replace(Cluster_series)
-# Get a copy with the updated ID
-Cluster_series_new_ID = Cluster_series.set_index(IDs).copy()
-# calculate the amount of each treatment present in each cluster
-ctb = pd.crosstab(Cluster_series_new_ID['Cluster'],
-                  Cluster_series_new_ID.index)
-# plot a stacked barplot of the clusters,
-# showing the composition of each
-print(f"Plotting now the stacked barplot for the composition of each cluster")
-fig_title = create_barplot_fig_title(fig_title)
-barplot = plot_stacked_barplot(Cluster_series, ctb, fig_title)
-barplot.savefig(f'{fig_title}_stacked_barplot.png',
-                bbox_inches='tight',
-                dpi=300)
+# the figure title of a csv file (or of a kind of filtered series in a store)
+def get_fig_title(name):
+    name = name.lower()
+    if ('mean' in name) or ('average' in name):
+        return 'moving average'
+    elif 'stddev' in name:
+        return 'moving standard deviation'
+    elif 'features' in name:
+        return 'light phase features'
+
+
+# drop all time points (or features) with na-values and bring the features
+# onto the same scale
+def prepare_dataframe(df, fig_title):
+    df = df.dropna(axis=1)
+    if fig_title == 'light phase features':
+        df = standardize_features(df)
+
+    return df
+
+
+# cluster the fish of the dataframe into amount_cluster clusters, save the
+# clustering results as csv and, if plot is True, the figures into the
+# folder. Returns the path of the csv, the clusters and the fish dropped
+def cluster_dataframe(df, fig_title, amount_cluster, folder, distances=None,
+                      metric='euclidean', method='complete', plot=True):
+    # calculate the linkage and get the
+    # list of outliers, the linkage and the clusters
+    print(f"Calculating the linkage.")
+    Cluster_series, outlier_list, recursive_linkage = (
+        calculate_hierarchy_linkage(df, amount_cluster, distances, metric,
+                                    method)
+        )
+    # drop the outliers from the original dataframe
+    # before continuing visualization
+    df = df.drop(outlier_list, axis=0)
+    # format the Cluster-assignment dataseries
+    Cluster_series.sort_values(inplace=True)
+    Cluster_series = Cluster_series.to_frame('Cluster')
+    print("Saving the Clustering results as csv file.")
+    output_path = (pathlib.Path(folder)
+                   / f"{fig_title}_HClustering_results.csv")
+    Cluster_series.to_csv(output_path,
+                          sep=',',
+                          header=True)
+    if not plot:
+        return output_path, Cluster_series, outlier_list
+
+    # get treatment info from the IDs
+    # (e.g. 97_EtOH3_96hpf_2 becomes EtOH3-96hpf)
+    IDs = get_treatments_and_replace(df)
+    # colors which should be used for the row_colors
+    # need to match the amount of unique treatments
+    colors_to_zip = ['orange', 'yellow', 'black', 'springgreen',
+                     'darkgreen', 'olive', 'deepskyblue', 'blue',
+                     'rosybrown', 'red', 'darkviolet']
+
+    row_colors, color_dictionary = create_row_colors(colors_to_zip,
+                                                     IDs, df)
+    print(f"Plotting and saving the clustermap.")
+    with ldt_profiling.step('plot_clustermap', rows=len(df)):
+        plot_clustermap(df, recursive_linkage, row_colors,
+                        color_dictionary, fig_title, folder)
+    print("Plotting and saving every cluster.")
+    with ldt_profiling.step('plot_clusters', rows=len(df)):
+        plot_clusters(df, Cluster_series, fig_title, folder)
+    # Get the IDs with "neg control" again
+    # for the sorted Cluster_series dataframe
+    IDs = get_treatments_and_replace(Cluster_series)
+    # Get a copy with the updated ID
+    Cluster_series_new_ID = Cluster_series.set_index(IDs).copy()
+    # calculate the amount of each treatment present in each cluster
+    ctb = pd.crosstab(Cluster_series_new_ID['Cluster'],
+                      Cluster_series_new_ID.index)
+    # plot a stacked barplot of the clusters,
+    # showing the composition of each
+    print("Plotting now the stacked barplot "
+          "for the composition of each cluster")
+    barplot_fig_title = create_barplot_fig_title(fig_title)
+    with ldt_profiling.step('plot_stacked_barplot',
+                            rows=len(Cluster_series)):
+        barplot = plot_stacked_barplot(Cluster_series, ctb,
+                                       barplot_fig_title)
+        barplot.savefig(pathlib.Path(folder)
+                        / f'{barplot_fig_title}_stacked_barplot.png',
+                        bbox_inches='tight',
+                        dpi=300)
+
+    return output_path, Cluster_series, outlier_list
+
+
+# cluster every "_moving_"/"_features" csv file in the folder (or the ones
+# given in path_list) into amount_cluster clusters, and save the results and
+# figures into the folder. If amount_cluster is None, the user is asked.
+# If a store is given, the moving average/standard deviation of the fish
+# matching the selection are read from the store instead of the csv files.
+# The paths of the clustering results are returned
+def main(folder, path_list=None, amount_cluster=None, store=None,
+         selection=None):
+    if store is not None:
+        # only the metainformation is queried here, the series of the
+        # selected fish are read when they are clustered
+        fish = ldt_store.select_fish(store, **(selection or {}))
+        path_list = ['moving_average', 'moving_stddev']
+    elif path_list is None:
+        path_list = get_file_paths(folder)
+    output_paths = []
+    # depending on whether its the rolling mean/stddev or the features
+    # the figure-title is defined
+    for path in path_list:
+        path = pathlib.Path(path)
+        fig_title = get_fig_title(path.name)
+        if store is not None:
+            print(f"loading the {fig_title} of {len(fish)} fish "
+                  "from the store.")
+            with ldt_profiling.step('load_filtered', rows=len(fish)):
+                df = ldt_store.load_filtered(store, fish, path.name)
+        else:
+            # read in the file
+            print(f"loading in file: {path.name}.")
+            with ldt_profiling.step('read_csv',
+                                    nbytes=os.path.getsize(path)) as record:
+                df = ldt_io.read_csv(path, sep=',', header=0, index_col=0)
+                record['rows'] = len(df)
+        df = prepare_dataframe(df, fig_title)
+        if amount_cluster is None:
+            n_cluster = get_amount_cluster()
+        else:
+            n_cluster = amount_cluster
+        output_path, _, _ = cluster_dataframe(df, fig_title, n_cluster,
+                                              folder)
+        output_paths.append(output_path)
+
+    return output_paths
+
+
+# the prepared dataframe of a csv file, or of a kind of filtered series
+# ('moving_average'/'moving_stddev') of the fish in a store matching the
+# selection (JSON text of the arguments of ldt_store.select_fish, "null" for
+# all fish). Only the series of the selected fish are read from the store.
+# The fingerprint of the file is part of the cache key, so a changed file is
+# loaded again
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def load_matrix(path, kind, fingerprint, selection='null'):
+    if kind is not None:
+        fish = ldt_store.select_fish(path, **(json.loads(selection) or {}))
+        print(f"loading the {kind} of {len(fish)} fish from the store.")
+        df = ldt_store.load_filtered(path, fish, kind)
+        fig_title = get_fig_title(kind)
+    else:
+        print(f"loading in file: {pathlib.Path(path).name}.")
+        df = ldt_io.read_csv(path, sep=',', header=0, index_col=0)
+        fig_title = get_fig_title(pathlib.Path(path).name)
+
+    return prepare_dataframe(df, fig_title)
+
+
+# the distances between the fish of a dataframe of load_matrix as a
+# fish x fish array. It starts empty (nan) and is filled by get_distances
+# with the distances of the fish clustered, so the distances of fish which
+# are never clustered together are not calculated
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def load_distances(path, kind, fingerprint, selection, metric):
+    size = len(load_matrix(path, kind, fingerprint, selection))
+
+    return np.full((size, size), np.nan)
+
+
+# the distances between the fish of df (a subset of the dataframe of
+# load_matrix with unique IDs) as a fish x fish dataframe. Only the
+# distances not calculated for an earlier request are calculated
+def get_distances(df, path, kind, fingerprint, selection, metric):
+    load_scipy()
+    matrix = load_matrix(path, kind, fingerprint, selection)
+    distances = load_distances(path, kind, fingerprint, selection, metric)
+    positions = matrix.index.get_indexer(df.index)
+    missing = positions[
+        np.isnan(distances[np.ix_(positions, positions)]).any(axis=1)]
+    if len(missing):
+        print(f"Calculating the {metric} distances of {len(missing)} of "
+              f"{len(positions)} fish.")
+        values = matrix.to_numpy()
+        calculated = distance.cdist(values[missing], values[positions],
+                                    metric=metric)
+        distances[np.ix_(missing, positions)] = calculated
+        distances[np.ix_(positions, missing)] = calculated.T
+
+    return pd.DataFrame(distances[np.ix_(positions, positions)],
+                        index=df.index, columns=df.index)
+
+
+# answer one request of the worker, e.g.
+#     {"path": "Fish_behaviour_moving_average.csv", "clusters": 4}
+# "path" is a csv file or a store (then "kind" is required), relative to the
+# folder. Optional are "fish" (list of IDs) or "selection" (store only, see
+# ldt_store.select_fish) to cluster a subset, "metric", "method", "plot",
+# "title" and the output "folder"
+def handle_request(request, folder):
+    path = str((pathlib.Path(folder) / request['path']).resolve())
+    kind = request.get('kind')
+    fingerprint = tuple(ldt_tools.file_fingerprint(path))
+    metric = request.get('metric', 'euclidean')
+    # the selection is part of the cache key, thus written in one way
+    selection = json.dumps(request.get('selection'), sort_keys=True)
+    df = load_matrix(path, kind, fingerprint, selection)
+    if 'fish' in request:
+        # the fish are given by their ID or, if the ID occurs on several
+        # plates of a store, by their label (see ldt_store.fish_labels)
+        ids = pd.Index([ldt_store.id_from_label(label) for label in df.index])
+        df = df[df.index.isin(request['fish']) | ids.isin(request['fish'])]
+    # the distances are looked up by ID, which needs unique IDs
+    distances = None
+    if load_matrix(path, kind, fingerprint, selection).index.is_unique:
+        distances = get_distances(df, path, kind, fingerprint, selection,
+                                  metric)
+    output_folder = pathlib.Path(folder) / request.get('folder', '.')
+    output_folder.mkdir(parents=True, exist_ok=True)
+    fig_title = request.get('title',
+                            get_fig_title(kind or pathlib.Path(path).name))
+    output_path, Cluster_series, outlier_list = cluster_dataframe(
+        df, fig_title, int(request['clusters']), output_folder, distances,
+        metric, request.get('method', 'complete'), request.get('plot', True))
+    # the figures of the request aren't needed anymore
+    if plt is not None:
+        plt.close('all')
+
+    return {'output': str(output_path),
+            'clusters': {str(fish_id): int(cluster) for fish_id, cluster
+                         in Cluster_series['Cluster'].items()},
+            'outliers': [str(fish_id) for fish_id in outlier_list]}
+
+
+# run as a worker: read one request per line (JSON) and write one response
+# per line (JSON) until the input ends or {"command": "quit"} is sent. The
+# progress messages are written to stderr, so stdout only contains responses
+def serve(folder, requests=None, responses=None):
+    requests = requests or sys.stdin
+    responses = responses or sys.stdout
+    for line in requests:
+        if not line.strip():
+            continue
+        start = time.perf_counter()
+        request = {}
+        try:
+            request = json.loads(line)
+            if request.get('command') == 'quit':
+                break
+            with contextlib.redirect_stdout(sys.stderr), \
+                    ldt_profiling.step('worker_request'):
+                response = handle_request(request, folder)
+            response['ok'] = True
+        # the worker keeps running if a request fails
+        except Exception as error:
+            response = {'ok': False,
+                        'error': f"{type(error).__name__}: {error}"}
+        if isinstance(request, dict) and 'id' in request:
+            response['id'] = request['id']
+        response['seconds'] = time.perf_counter() - start
+        response['cached'] = {
+            'matrices': load_matrix.cache_info().currsize,
+            'distances': load_distances.cache_info().currsize}
+        responses.write(json.dumps(response) + '\n')
+        responses.flush()
+
+
+if __name__ == '__main__':
+    # Set the scripts location as working directory
+    script_location = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_location)
+    # optionally, the fish are selected from the store of a campaign
+    parser = argparse.ArgumentParser(
+        description="Cluster the filtered time series of all fish in the "
+                    "folder, or of the fish selected from a store.")
+    ldt_store.add_selection_arguments(parser)
+    parser.add_argument('--worker', action='store_true',
+                        help="keep running and answer clustering requests "
+                             "(one JSON object per line) from stdin")
+    args = parser.parse_args()
+    if args.worker:
+        serve(os.getcwd())
+    else:
+        main(os.getcwd(), store=args.store,
+             selection=ldt_store.selection_from_arguments(args))
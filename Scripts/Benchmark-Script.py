@@ -0,0 +1,186 @@
+"""
+This script benchmarks the four scripts
+1. Import script
+2. Outlier script
+3. Filtering script
+4. Analysis script
+established to analyse the output of the Light/Dark transition test.
+It generates synthetic experiments of several sizes with the
+Synthetic-Data-Script and measures the time and the peak memory of each step
+(parsing the raw files, annotating them with the light conditions and the
+treatments, appending them, writing the csv file plain and compressed, the
+rolling sum of the outlier detection, reshaping, the handling of the gaps,
+the moving filters, the linkage and the plots). The steps are run with the
+functions of the scripts. The memory is the peak of the resident memory
+during a step (sampled, see ldt_profiling) above the memory before it.
+The results are printed and saved as "benchmark_results.json".
+
+Usage: python Benchmark-Script.py --scales 24:600 96:3600
+
+It was developed at the Computational Ecology working group,
+Institute for Environmental Research, Biology V, RWTH Aachen.
+
+For questions please contact: dominik.ziaja@rwth-aachen.de
+"""
+
+import argparse
+import json
+import pathlib
+import tempfile
+import time
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import pandas as pd
+
+import ldt_profiling
+import ldt_tools
+
+
+# run a step once, and save its wall time, peak memory and throughput
+# in the results. The memory is sampled by a thread instead of tracing the
+# allocations, which would slow down steps creating many python objects and
+# thus distort the times. The result of the step is returned
+def measure(results, scale, step, rows, func, *args):
+    with ldt_profiling.sample_rss() as memory:
+        start = time.perf_counter()
+        result = func(*args)
+        seconds = time.perf_counter() - start
+    peak = None
+    if memory['start'] is not None:
+        peak = memory['peak'] - memory['start']
+    results.append({'scale': scale, 'step': step, 'rows': int(rows),
+                    'seconds': seconds, 'peak_mb': peak,
+                    'rows_per_second': rows / seconds if seconds else None})
+    print(f"{scale:>10} {step:<22} {seconds:9.3f} s "
+          f"{peak if peak is not None else float('nan'):9.1f} MB")
+
+    return result
+
+
+# the steps of the import script, called for all raw files in the same
+# order as its main does, so each step can be measured on its own
+def parse_files(import_script, raw_paths):
+    return [import_script.parse_raw_file(raw_path) for raw_path in raw_paths]
+
+
+def annotate_files(import_script, parsed, light_dark_meta, treatment, hpf,
+                   replicate):
+    return [import_script.annotate_fish(df2, header, light_dark_meta,
+                                        treatment, hpf, replicate)
+            for df2, header in parsed]
+
+
+def append_files(import_script, annotated):
+    data = pd.DataFrame()
+    for df2 in annotated:
+        data = import_script.append_fish(data, df2)
+
+    return data
+
+
+def plot_results(analysis_script, df, linkage, cluster_series, folder):
+    IDs = analysis_script.get_treatments_and_replace(df)
+    colors_to_zip = ['orange', 'yellow', 'black', 'springgreen',
+                     'darkgreen', 'olive', 'deepskyblue', 'blue',
+                     'rosybrown', 'red', 'darkviolet']
+    row_colors, color_dictionary = analysis_script.create_row_colors(
+        colors_to_zip, IDs, df)
+    analysis_script.plot_clustermap(df, linkage, row_colors,
+                                    color_dictionary, 'benchmark', folder)
+    analysis_script.plot_clusters(df, cluster_series.to_frame('Cluster'),
+                                  'benchmark', folder)
+    plt.close('all')
+
+
+# benchmark all steps for one synthetic experiment of the given size
+def benchmark_scale(results, wells, trial_length, frame_rate, window,
+                    amount_cluster, threshold, fill_gaps=False):
+    synthetic = ldt_tools.load_script('Synthetic-Data-Script.py')
+    import_script = ldt_tools.load_script('Import-Script.py')
+    outlier_script = ldt_tools.load_script('Outlier-Script.py')
+    filtering_script = ldt_tools.load_script('Filtering-Script.py')
+    analysis_script = ldt_tools.load_script('Analysis-Script.py')
+    # import scipy and seaborn now, so it isn't measured as part of a step
+    analysis_script.load_scipy()
+    analysis_script.load_plotting()
+    scale = f"{wells}:{trial_length:g}"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = synthetic.main(tmp, wells=wells, trial_length=trial_length,
+                                frame_rate=frame_rate)[0]
+        light_dark_meta, treatment, exp_design_meta, raw_paths = (
+            import_script.read_folder(folder))
+        hpf, replicate = exp_design_meta[1], exp_design_meta[3]
+        rows = int(trial_length * frame_rate) * len(raw_paths)
+
+        parsed = measure(results, scale, 'parse', rows,
+                         parse_files, import_script, raw_paths)
+        annotated = measure(results, scale, 'annotation', rows,
+                            annotate_files, import_script, parsed,
+                            light_dark_meta, treatment, hpf, replicate)
+        del parsed
+        behaviour = measure(results, scale, 'append', rows,
+                            append_files, import_script, annotated)
+        del annotated
+        for compression in [None, 'gzip']:
+            measure(results, scale,
+                    f"write csv {compression or 'plain'}", rows,
+                    import_script.write_behaviour_dataframe, behaviour, tmp,
+                    replicate, None, compression)
+        behaviour = outlier_script.set_indices(behaviour)
+        _, behaviour = measure(results, scale, 'outlier rolling sum', rows,
+                               outlier_script.remove_outliers, threshold,
+                               behaviour)
+        behaviour = outlier_script.rearrange_columns(behaviour)
+        df_all = measure(results, scale, 'reshape', rows,
+                         filtering_script.format_dataframe, behaviour)
+        del behaviour
+        df_all = measure(results, scale, 'gaps', rows,
+                         filtering_script.remove_gaps, df_all, fill_gaps)
+        rolling_mean, _ = measure(results, scale, 'rolling filter', rows,
+                                  filtering_script.rolling_filter, df_all,
+                                  window)
+        rolling_mean = analysis_script.prepare_dataframe(rolling_mean,
+                                                         'moving average')
+        cluster_series, outlier_list, linkage = measure(
+            results, scale, 'linkage', len(rolling_mean),
+            analysis_script.calculate_hierarchy_linkage, rolling_mean,
+            amount_cluster)
+        rolling_mean = rolling_mean.drop(outlier_list, axis=0)
+        measure(results, scale, 'plotting', len(rolling_mean),
+                plot_results, analysis_script, rolling_mean, linkage,
+                cluster_series, tmp)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Benchmark the Light/Dark transition test scripts.")
+    parser.add_argument('--scales', nargs='+',
+                        default=['24:600', '48:1800', '96:3600'],
+                        help="experiment sizes as wells:trial length [s]")
+    parser.add_argument('--frame-rate', type=float, default=25)
+    parser.add_argument('--window', type=int, default=12000,
+                        help="window width of the moving filters, "
+                             "shortened to half of the trial if needed")
+    parser.add_argument('--clusters', type=int, default=4)
+    parser.add_argument('--threshold', type=float, default=750)
+    parser.add_argument('--fill-gaps', action='store_true',
+                        help="fill the gaps like the filtering script with "
+                             "--fill-gaps instead of dropping them")
+    parser.add_argument('--output', default='benchmark_results.json')
+    args = parser.parse_args()
+
+    results = []
+    for scale in args.scales:
+        wells, trial_length = scale.split(':')
+        trial_length = float(trial_length)
+        window = min(args.window, int(trial_length * args.frame_rate) // 2)
+        benchmark_scale(results, int(wells), trial_length, args.frame_rate,
+                        window, args.clusters, args.threshold,
+                        args.fill_gaps)
+
+    with open(pathlib.Path(args.output), 'w') as outputfile:
+        json.dump(results, outputfile, indent=1)
+    print(f"saved the results in {args.output}")
@@ -0,0 +1,201 @@
+"""
+This script is an optional addition to the four scripts
+1. Import script
+2. Outlier script
+3. Filtering script
+4. Analysis script
+established to analyse the output of the Light/Dark transition test.
+It splits the time series of every fish into its light and dark phases and
+extracts a small set of behavioural features for each phase (distance moved,
+activity bouts, latency and peak of the response after the transition and
+the habituation slope). The resulting fish x feature matrix can be clustered
+by the analysis script instead of, or alongside, the moving average and
+moving standard deviation. The script operates on the output of the outlier
+ (second) script.
+
+It was developed at the Computational Ecology working group,
+Institute for Environmental Research, Biology V, RWTH Aachen.
+
+For questions please contact: dominik.ziaja@rwth-aachen.de
+"""
+
+import pandas as pd
+import numpy as np
+import pathlib
+import os
+
+import ldt_io
+import ldt_profiling
+
+
+# Get a list of all csv-files with "_wo_outliers" in their name
+# as this is the name saved by the outlier script beforehand
+def get_file_paths(path):
+    filepaths = [filepath for filepath in
+                 ldt_io.glob_csv(path, '*_wo_outliers')]
+
+    return filepaths
+
+
+# number every light and dark phase of each fish, starting with 1 for the
+# phase the trial starts in, and add the time passed since the phase started
+def assign_light_phases(df):
+    # sort by fish and time, so consecutive rows belong to the same fish
+    # mergesort is stable and keeps the order of equal trial times
+    df = df.sort_values(['ID', 'Trial_time [s]'], kind='mergesort')
+    df.reset_index(drop=True, inplace=True)
+    # a new phase starts with every new fish and every change of the light
+    new_fish = df['ID'] != df['ID'].shift()
+    new_phase = new_fish | (df['Light_on_off'] != df['Light_on_off'].shift())
+    df['Phase'] = new_phase.astype(int).groupby(df['ID']).cumsum()
+    # the trial time at which the phase started is the first time in each
+    # phase (the dataframe is sorted) and is broadcasted to all of its rows
+    phase_start = df['Trial_time [s]'].where(new_phase).ffill()
+    df['Phase_time [s]'] = df['Trial_time [s]'] - phase_start
+
+    return df, new_phase
+
+
+# calculate all features for each fish and phase in one grouped pass.
+# Every feature is reduced from a column prepared for the whole dataframe,
+# so no python loop over fish or phases is necessary
+def calculate_phase_features(df, new_phase, movement_threshold,
+                             response_window, peak_window):
+    distance = df['Distance_moved [mm]']
+    keys = [df['ID'], df['Phase']]
+    # a fish counts as moving if it moved more than the threshold in a frame
+    moving = distance > movement_threshold
+    # a bout starts wherever the fish moves but did not move in the frame
+    # before, or wherever it already moves at the beginning of a phase
+    bout_start = moving & ~(moving.shift(fill_value=False) & ~new_phase)
+    # the trial time within the phase of all frames the fish moved in,
+    # the first one of each phase is the latency of the response
+    moving_time = df['Phase_time [s]'].where(moving)
+    # sum the distance over a short window (peak_window values) within each
+    # phase to get the strength of the response, but only within the
+    # response window after the transition
+    cumulative = distance.fillna(0).groupby(keys).cumsum()
+    rolled = cumulative - cumulative.groupby(keys).shift(peak_window,
+                                                         fill_value=0)
+    response = rolled.where(df['Phase_time [s]'] <= response_window)
+    # terms for the least squares slope of the distance over the phase time
+    # (habituation), na-values are left out of every sum
+    valid = distance.notna()
+    time = df['Phase_time [s]'].where(valid)
+
+    features = pd.DataFrame({
+        'Light_on_off': df['Light_on_off'],
+        'total_distance': distance,
+        'mean_distance': distance,
+        'bouts': bout_start.astype(int),
+        'latency': moving_time,
+        'duration': df['Phase_time [s]'],
+        'peak': response,
+        'n': valid.astype(int),
+        'x': time,
+        'y': distance,
+        'xy': time * distance,
+        'xx': time * time,
+        })
+    grouped = features.groupby(keys, sort=True).agg({
+        'Light_on_off': 'first',
+        'total_distance': 'sum',
+        'mean_distance': 'mean',
+        'bouts': 'sum',
+        'latency': 'min',
+        'duration': 'max',
+        'peak': 'max',
+        'n': 'sum',
+        'x': 'sum',
+        'y': 'sum',
+        'xy': 'sum',
+        'xx': 'sum',
+        })
+    # slope = (n*sum(xy) - sum(x)*sum(y)) / (n*sum(xx) - sum(x)^2)
+    numerator = grouped['n'] * grouped['xy'] - grouped['x'] * grouped['y']
+    denominator = grouped['n'] * grouped['xx'] - grouped['x'] ** 2
+    grouped['habituation_slope'] = numerator / denominator.replace(0, np.nan)
+    # a fish which didn't move in a phase has no latency. It is censored at
+    # the length of the phase, instead of a na-value which would drop the
+    # latency of this phase for all fish before the clustering
+    grouped['latency'] = grouped['latency'].fillna(grouped['duration'])
+    grouped.drop(columns=['duration', 'n', 'x', 'y', 'xy', 'xx'],
+                 inplace=True)
+
+    return grouped
+
+
+# format the features into a fish x feature format, where every column
+# is named after the phase, its light condition and the feature
+# e.g. "P2_dark_latency"
+def format_feature_matrix(features):
+    # the light condition of each phase is taken from the first fish,
+    # as all fish of an experiment share the same light/dark schedule
+    light = (features['Light_on_off'].groupby(level='Phase').first()
+             .map({1: 'light', 0: 'dark'}))
+    matrix = features.drop(columns=['Light_on_off']).unstack(level='Phase')
+    matrix.columns = ['_'.join([f"P{phase}", str(light[phase]), feature])
+                      for feature, phase in matrix.columns]
+    # order the columns by phase first, so all features of one phase
+    # are next to each other
+    ordered = sorted(matrix.columns,
+                     key=lambda column: int(column.split('_')[0][1:]))
+    matrix = matrix[ordered]
+    matrix.index.name = 'ID'
+
+    return matrix
+
+
+# extract the light phase features of all fish in the "_wo_outliers" files of
+# the folder (or the ones given in datafile_paths) and write the feature
+# matrix as csv into the folder. The path of the csv is returned
+def main(folder, datafile_paths=None, movement_threshold=0.1,
+         response_window=60, peak_window=25):
+    # get all csv files with "_wo_outliers" in the folder.
+    if datafile_paths is None:
+        datafile_paths = get_file_paths(folder)
+    # collect the feature matrix of each file in a list
+    feature_matrices = []
+
+    for idx, filepath in enumerate(datafile_paths, 1):
+        print(f"file number {idx} of {len(datafile_paths)} "
+              "is being processed.")
+        with ldt_profiling.step('read_csv',
+                                nbytes=os.path.getsize(filepath)) as record:
+            df = ldt_io.read_csv(filepath, sep=',', header=0,
+                                 usecols=['Trial_time [s]',
+                                          'Distance_moved [mm]',
+                                          'Light_on_off', 'ID'])
+            record['rows'] = len(df)
+        with ldt_profiling.step('assign_light_phases', rows=len(df)):
+            df, new_phase = assign_light_phases(df)
+        with ldt_profiling.step('calculate_phase_features', rows=len(df)):
+            features = calculate_phase_features(df, new_phase,
+                                                movement_threshold,
+                                                response_window, peak_window)
+        feature_matrices.append(format_feature_matrix(features))
+
+    # combine the fish of all files, phases missing in a file become na-values
+    df_features = pd.concat(feature_matrices, axis=0, sort=False)
+    print("Writing the feature matrix to the harddisk")
+    output_path = pathlib.Path(folder) / 'Fish_behaviour_features.csv'
+    with ldt_profiling.step('to_csv', rows=len(df_features)) as record:
+        df_features.to_csv(output_path, index=True, header=True, sep=',')
+        record['bytes'] = os.path.getsize(output_path)
+
+    return output_path
+
+
+if __name__ == '__main__':
+    movement_threshold = 0.1  # > 0.1 mm per value is determined as movement
+    response_window = 60  # the response is searched within the first
+                          # 60 seconds after a transition
+    peak_window = 25  # the response is summed over 25 values (1 second)
+    # set the path where the script is located as the current working
+    # directory
+    script_location = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_location)
+    # and print it out for control
+    print("operating in datapath {} ".format(os.getcwd()))
+    main(os.getcwd(), movement_threshold=movement_threshold,
+         response_window=response_window, peak_window=peak_window)
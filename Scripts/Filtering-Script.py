@@ -23,13 +23,25 @@ import pandas as pd
 import numpy as np
 import pathlib
 import os
+import argparse
+import json
 
+import ldt_io
+import ldt_profiling
+import ldt_store
+import ldt_tools
 
-# Get a list of all csv-files with "processed_with_na" in their name
-# as this is the name saved by the script beforehand
+
+# remembers which files are combined in the outputs, see append_new_files
+MANIFEST_FILENAME = 'Fish_behaviour_manifest.json'
+
+
+# Get a list of all csv-files with "_wo_outliers" in their name
+# as this is the name saved by the outlier script beforehand. The outputs
+# of this script ("Fish_behaviour_...") are not included
 def get_file_paths(path):
     filepaths = [filepath for filepath in
-                 pathlib.Path(path).glob('*.csv')]
+                 ldt_io.glob_csv(path, '*_wo_outliers')]
 
     return filepaths
 
@@ -69,70 +81,338 @@ def add_Dataframes_together(df, df_together):
     return df_together
 
 
-# set the path where the script is located as the current working directory
-script_location = os.path.dirname(os.path.abspath(__file__))
-os.chdir(script_location)
-# and print it out for control
-print("operating in datapath {} ".format(os.getcwd()))
-# get all csv files with "na_processed" in the scripts directory.
-datafile_paths = get_file_paths(os.getcwd())
-
-# create an empty dataframe to collect all values in it
-df_all = pd.DataFrame()
-
-
-for idx, filepath in enumerate(datafile_paths, 1):
-    df = pd.read_csv(filepath, sep=',', header=0)
-
-    print(f"file number {idx} of {len(datafile_paths)} is being processed.")
-    # extract only the min and max concentration (NegControl, max Conc)
-    # of each treatment except:
-    # if EtOH is the treatment,
-    # Then NegaControl and second highest Concentration are selected
-    # Yet "EtOH" needs to be written that way.
-    # Maybe make it case insensitive check
-    if np.isin(df['Substance'].unique(), 'EtOH').any():
-        df_subset = df[
-                np.logical_or(
-                             df['Concentration']
-                             == df['Concentration'].min(skipna=True),
-                             df['Concentration']
-                             == np.sort(df['Concentration'].unique())[-2])
-                ]
+# extract only the min and max concentration (NegControl, max Conc) of the
+# files in datafile_paths (one per replicate) and combine them
+def combine_files(datafile_paths):
+    # create an empty dataframe to collect all values in it
+    df_all = pd.DataFrame()
+
+    for idx, filepath in enumerate(datafile_paths, 1):
+        with ldt_profiling.step('read_csv',
+                                nbytes=os.path.getsize(filepath)) as record:
+            df = ldt_io.read_csv(filepath, sep=',', header=0)
+            record['rows'] = len(df)
+
+        print(f"file number {idx} of {len(datafile_paths)} "
+              "is being processed.")
+        # extract only the min and max concentration (NegControl, max Conc)
+        # of each treatment except:
+        # if EtOH is the treatment,
+        # Then NegaControl and second highest Concentration are selected
+        # Yet "EtOH" needs to be written that way.
+        # Maybe make it case insensitive check
+        if np.isin(df['Substance'].unique(), 'EtOH').any():
+            df_subset = df[
+                    np.logical_or(
+                                 df['Concentration']
+                                 == df['Concentration'].min(skipna=True),
+                                 df['Concentration']
+                                 == np.sort(df['Concentration'].unique())[-2])
+                    ]
+        else:
+            df_subset = df[
+                    (df['Concentration'] == df['Concentration'].max())
+                    | (df['Concentration'] == df['Concentration'].min())]
+        # set each ind. to a column in a transposed dataframe
+        with ldt_profiling.step('format_dataframe', rows=len(df_subset)):
+            df2 = format_dataframe(df_subset)
+
+        with ldt_profiling.step('add_Dataframes_together', rows=len(df2),
+                                cells=df2.size):
+            df_all = add_Dataframes_together(df2, df_all)
+
+    # set the trial time as index of the big dataframe
+    try:
+        df_all.set_index(df['Trial_time [s]'].unique(), inplace=True)
+    # if an exception is raised, print the following error.
+    except:
+        print("Exception arised, maybe the dataframes don't"
+              "have the equal length of Time points")
+
+    # delete the big dataframe to get some RAM back
+    del df
+
+    return df_all
+
+
+# the concentrations kept of one replicate, based on the metainformation in
+# the store: the min and max concentration (NegControl, max Conc), or the
+# NegControl and the second highest concentration if EtOH is the treatment.
+# Replicates with less than two concentrations are kept as they are
+def select_concentrations(substances, concentrations):
+    unique_concentrations = np.sort(concentrations.dropna().unique())
+    if len(unique_concentrations) < 2:
+        return list(unique_concentrations)
+    if np.isin(substances.unique(), 'EtOH').any():
+        return [unique_concentrations[0], unique_concentrations[-2]]
+
+    return [unique_concentrations[0], unique_concentrations[-1]]
+
+
+# the same as combine_files, but for the fish in the store matching the
+# selection (e.g. {'substance': 'EtOH', 'hpf': 96}). The concentrations are
+# chosen on the metainformation, so only the series of the kept fish are
+# read. If the selection contains concentrations, all selected fish are
+# kept instead of the min/max concentration of each replicate. Returns the
+# combined dataframe, labeled like ldt_store.fish_labels, and (plate, well)
+# of every column
+def combine_from_store(store, selection):
+    fish = ldt_store.select_fish(store, **selection)
+    df_all = pd.DataFrame()
+    keys = []
+    for idx, (plate, plate_fish) in enumerate(fish.groupby('plate'), 1):
+        print(f"replicate {idx} of {fish['plate'].nunique()} "
+              "is being processed.")
+        if selection.get('concentration') is None:
+            kept = select_concentrations(plate_fish['substance'],
+                                         plate_fish['concentration'])
+            plate_fish = plate_fish[plate_fish['concentration'].isin(kept)]
+        with ldt_profiling.step('load_series', rows=len(plate_fish)):
+            df2 = ldt_store.load_series(store, plate_fish)
+
+        with ldt_profiling.step('add_Dataframes_together', rows=len(df2),
+                                cells=df2.size):
+            df_all = add_Dataframes_together(df2, df_all)
+        keys.extend(zip(plate_fish['plate'], plate_fish['well'],
+                        plate_fish['id']))
+    # the IDs may occur on several plates, which is only known now
+    if keys:
+        df_all.columns = ldt_store.fish_labels(keys)
+
+    return df_all, [(plate, well) for plate, well, _ in keys]
+
+
+# fill the gaps (na-values) of every fish by linear interpolation over the
+# trial time between its own values before and after the gap. Na-values
+# before the first or after the last value of a fish are kept. As each fish
+# is filled on its own, the time points kept don't depend on the other fish
+def interpolate_gaps(df_all):
+    return df_all.interpolate(method='index', limit_area='inside')
+
+
+# handle the na-values of the combined fish: by default every time point with
+# a na-value in any fish is dropped. If fill_gaps is True, the gaps of each
+# fish are filled instead (see interpolate_gaps)
+def remove_gaps(df_all, fill_gaps=False):
+    if fill_gaps:
+        return interpolate_gaps(df_all)
+
+    return df_all.dropna()
+
+
+def fingerprint_files(datafile_paths):
+    return [ldt_tools.file_fingerprint(pathlib.Path(path).resolve())
+            for path in datafile_paths]
+
+
+# save the fingerprints of the files combined in the outputs, the window
+# width of the filters, the precision of the values and whether the gaps were
+# filled next to the outputs
+def write_manifest(folder, datafile_paths, window, precision, fill_gaps):
+    with open(pathlib.Path(folder) / MANIFEST_FILENAME, 'w') as manifest:
+        json.dump({'window': window, 'precision': precision,
+                   'fill_gaps': fill_gaps,
+                   'files': fingerprint_files(datafile_paths)},
+                  manifest, indent=1)
+
+
+# add the columns of df to the right of a csv file written by write_csv with
+# the same amount of rows, without parsing the values already in the file
+def append_columns_to_csv(path, df, precision=None):
+    new_lines = ldt_io.format_csv(df, precision, index=False, header=True,
+                                  sep=',').splitlines()
+    # same ending as the file, so it is compressed the same way
+    temporary_path = path.with_name('tmp_' + path.name)
+    with ldt_io.open_csv(path) as old_file, \
+            ldt_io.open_csv(temporary_path, 'w') as new_file:
+        for counter, old_line in enumerate(old_file):
+            content = old_line.rstrip('\r\n')
+            new_file.write(content + ',' + new_lines[counter]
+                           + old_line[len(content):])
+    if counter + 1 != len(new_lines):
+        temporary_path.unlink()
+        raise ValueError(f"{path} has {counter + 1} lines, but "
+                         f"{len(new_lines)} lines should be appended")
+    os.replace(temporary_path, path)
+
+
+# apply the moving average and moving standard deviation with a window of
+# "window" values to every fish (column) of the combined dataframe. The
+# results are transposed into the fish x timepoints format
+def rolling_filter(df_all, window):
+    rolling = df_all.rolling(center=True, window=window)
+
+    return rolling.mean().T, rolling.std().T
+
+
+# add the fish of files that weren't combined so far to the outputs of the
+# last run, which needs filled gaps (see remove_gaps). As the gaps are filled
+# and the filters are applied to each fish on its own, the values of the fish
+# already in the outputs don't change and are not calculated again. Returns
+# False if all files need to be combined again, e.g. if a file combined
+# before was changed, the window width or the handling of the gaps differs
+# or the new files were recorded at other time points
+def append_new_files(folder, datafile_paths, window, precision,
+                     output_paths):
+    manifest_path = pathlib.Path(folder) / MANIFEST_FILENAME
+    if (not manifest_path.exists()
+            or not all(path.exists() for path in output_paths)):
+        print("No previous results found, combining all files.")
+        return False
+    with open(manifest_path) as manifest_file:
+        manifest = json.load(manifest_file)
+    if (manifest['window'] != window
+            or manifest.get('precision') != precision
+            or not manifest.get('fill_gaps')):
+        print("The window width, precision or handling of the gaps "
+              "changed, combining all files.")
+        return False
+    known = {tuple(fingerprint) for fingerprint in manifest['files']}
+    current = [tuple(fingerprint)
+               for fingerprint in fingerprint_files(datafile_paths)]
+    if not known <= set(current):
+        print("Files combined before were changed or removed, "
+              "combining all files.")
+        return False
+    new_paths = [path for path, fingerprint in zip(datafile_paths, current)
+                 if fingerprint not in known]
+    if not new_paths:
+        print("No new files found, the results are up to date.")
+        return True
+
+    print(f"Adding {len(new_paths)} new files to the results.")
+    df_new = combine_files(new_paths)
+    # the new fish need the time points of the outputs so far (the header
+    # of the moving average) to be added as columns
+    kept_time = ldt_io.read_csv(output_paths[2], sep=',', nrows=0,
+                                index_col=0).columns.astype(float)
+    if not df_new.index.equals(kept_time):
+        print("The new files were recorded at other time points, "
+              "combining all files.")
+        return False
+    df_new = interpolate_gaps(df_new)
+    with ldt_profiling.step('rolling_filter', rows=len(df_new),
+                            cells=df_new.size):
+        rolling_mean, rolling_stddev = rolling_filter(df_new, window)
+    print("Appending the new fish to the results on the harddisk")
+    with ldt_profiling.step('append_columns_to_csv', rows=len(df_new),
+                            cells=df_new.size):
+        append_columns_to_csv(output_paths[0], df_new, precision)
+    with ldt_profiling.step('to_csv', rows=len(rolling_stddev),
+                            cells=rolling_stddev.size):
+        ldt_io.write_csv(rolling_stddev, output_paths[1], header=False,
+                         precision=precision, mode='a')
+    with ldt_profiling.step('to_csv', rows=len(rolling_mean),
+                            cells=rolling_mean.size):
+        ldt_io.write_csv(rolling_mean, output_paths[2], header=False,
+                         precision=precision, mode='a')
+    write_manifest(folder, datafile_paths, window, precision, True)
+
+    return True
+
+
+# combine all csv files in the folder (or the ones given in datafile_paths),
+# apply the moving average and moving standard deviation with a window of
+# "window" values and write the results as csv into the folder.
+# If a store is given, the fish matching the selection are read from the
+# store instead, and the filtered series are written into the store as well.
+# If incremental is True, only files which weren't combined in the last run
+# are processed and appended to its results (see append_new_files), which
+# implies fill_gaps. If fill_gaps is True, the gaps of each fish are filled
+# instead of dropping their time points for all fish (see remove_gaps).
+# The values are rounded to "precision" decimal places and the csv files
+# compressed with "compression" ('gzip' or 'zstd'), see ldt_io.
+# The paths of the three csv files are returned
+def main(folder, datafile_paths=None, window=12000, store=None,
+         selection=None, incremental=False, precision=None,
+         compression=None, fill_gaps=False):
+    fill_gaps = fill_gaps or incremental
+    output_paths = [
+        ldt_io.with_compression(pathlib.Path(folder) / filename, compression)
+        for filename in ['Fish_behaviour_unfiltered.csv',
+                         'Fish_behaviour_moving_stddev.csv',
+                         'Fish_behaviour_moving_average.csv']]
+    if store is not None:
+        df_all, keys = combine_from_store(store, selection or {})
     else:
-        df_subset = df[
-                (df['Concentration'] == df['Concentration'].max())
-                | (df['Concentration'] == df['Concentration'].min())]
-    # set each ind. to a column in a transposed dataframe
-    df2 = format_dataframe(df_subset)
-
-    df_all = add_Dataframes_together(df2, df_all)
-
-# set the trial time as index of the big dataframe
-try:
-    df_all.set_index(df['Trial_time [s]'].unique(), inplace=True)
-# if an exception is raised, print the following error.
-except:
-    print("Exception arised, maybe the dataframes don't"
-          "have the equal length of Time points")
-
-# delete the big dataframe to get some RAM back
-del df
-# when every file is concatenated, drop na-values
-df_all.dropna(inplace=True)
-# define window width of the filters
-rolling = df_all.rolling(center=True, window=12000)
-# and apply the filters, save it transposed (fish x timepoints format)
-rolling_mean = rolling.mean().T
-rolling_stddev = rolling.std().T
-# save the dataframe unrolled as well as rolled
-print("Writing the combined dataframe without "
-      "applied filters to the harddisk")
-df_all.to_csv(f'Fish_behaviour_unfiltered.csv',
-              index=True, header=True, sep=',')
-print("Writing the moving standard deviation to the harddisk")
-rolling_stddev.to_csv(f'Fish_behaviour_moving_stddev.csv',
-                      index=True, header=True, sep=',')
-print("Writing the moving average to the harddisk")
-rolling_mean.to_csv(fr'Fish_behaviour_moving_average.csv',
-                    index=True, header=True, sep=',')
+        # get all csv files in the folder
+        if datafile_paths is None:
+            datafile_paths = get_file_paths(folder)
+        if incremental and append_new_files(folder, datafile_paths, window,
+                                            precision, output_paths):
+            return output_paths
+        df_all = combine_files(datafile_paths)
+
+    # when every file is concatenated, drop (or fill) na-values
+    df_all = remove_gaps(df_all, fill_gaps)
+    with ldt_profiling.step('rolling_filter', rows=len(df_all),
+                            cells=df_all.size):
+        # apply the filters, saved transposed (fish x timepoints format)
+        rolling_mean, rolling_stddev = rolling_filter(df_all, window)
+    # store the filtered series of every fish, so the analysis script can
+    # load the ones of selected fish only
+    if store is not None:
+        with ldt_profiling.step('write_filtered', rows=len(rolling_mean),
+                                cells=rolling_mean.size):
+            ldt_store.write_filtered(store, keys, rolling_mean,
+                                     'moving_average')
+            ldt_store.write_filtered(store, keys, rolling_stddev,
+                                     'moving_stddev')
+    # save the dataframe unrolled as well as rolled
+    print("Writing the combined dataframe without "
+          "applied filters to the harddisk")
+    with ldt_profiling.step('to_csv', rows=len(df_all),
+                            cells=df_all.size) as record:
+        ldt_io.write_csv(df_all, output_paths[0], precision=precision)
+        record['bytes'] = os.path.getsize(output_paths[0])
+    print("Writing the moving standard deviation to the harddisk")
+    with ldt_profiling.step('to_csv', rows=len(rolling_stddev),
+                            cells=rolling_stddev.size) as record:
+        ldt_io.write_csv(rolling_stddev, output_paths[1],
+                         precision=precision)
+        record['bytes'] = os.path.getsize(output_paths[1])
+    print("Writing the moving average to the harddisk")
+    with ldt_profiling.step('to_csv', rows=len(rolling_mean),
+                            cells=rolling_mean.size) as record:
+        ldt_io.write_csv(rolling_mean, output_paths[2], precision=precision)
+        record['bytes'] = os.path.getsize(output_paths[2])
+    # remember the combined files for the next incremental run. Results
+    # of a store can't be extended, thus an old manifest is removed
+    if store is None:
+        write_manifest(folder, datafile_paths, window, precision,
+                       fill_gaps)
+    elif (pathlib.Path(folder) / MANIFEST_FILENAME).exists():
+        (pathlib.Path(folder) / MANIFEST_FILENAME).unlink()
+
+    return output_paths
+
+
+if __name__ == '__main__':
+    # set the path where the script is located as the current working
+    # directory
+    script_location = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_location)
+    # and print it out for control
+    print("operating in datapath {} ".format(os.getcwd()))
+    # optionally, the fish are selected from the store of a campaign
+    parser = argparse.ArgumentParser(
+        description="Filter the time series of all fish in the folder, or "
+                    "of the fish selected from a store.")
+    ldt_store.add_selection_arguments(parser)
+    parser.add_argument('--incremental', action='store_true',
+                        help="only add files which are new since the last "
+                             "run to its results (implies --fill-gaps)")
+    parser.add_argument('--fill-gaps', action='store_true',
+                        help="fill the gaps of each fish by interpolation "
+                             "instead of dropping their time points for all "
+                             "fish")
+    parser.add_argument('--precision', type=int, default=None,
+                        help="decimal places of the values written")
+    parser.add_argument('--compression', default=None,
+                        choices=sorted(ldt_io.COMPRESSION_SUFFIXES),
+                        help="compress the csv files")
+    args = parser.parse_args()
+    main(os.getcwd(), store=args.store,
+         selection=ldt_store.selection_from_arguments(args),
+         incremental=args.incremental, precision=args.precision,
+         compression=args.compression, fill_gaps=args.fill_gaps)
@@ -22,6 +22,9 @@ import re
 import pathlib
 import os
 
+import ldt_io
+import ldt_profiling
+
 
 def compress_list(nested_list):
     unnested_list = []
@@ -161,86 +164,88 @@ def insert_lighton_lightoff(dataframe, light_dark_metadata):
     return dataframe
 
 
-# set the path where the script is located as the current working directory
-script_location = os.path.dirname(os.path.abspath(__file__))
-os.chdir(script_location)
-# and print it out for control
-print("operating in datapath {} ".format(os.getcwd()))
-# get the paths of all files located in the current working directory in a list
-operating_path = pathlib.Path(os.getcwd())
-files_path_list = [file_path.as_posix()
-                   for file_path in operating_path.glob('*')]
-# generate an empty dataframe where all fish_files will be stored in
-# and an empty list to append the paths of the raw files for each fish
-data = pd.DataFrame()
-fishmovement_file_paths = []
-
-# iterate through all files in the folder where the script is located
-for item in files_path_list:
-    pathlib_item = pathlib.Path(item)
-    # check if 'meta' is in a case-insensitive version of the filename
-    if ('meta' in pathlib_item.name.lower()):
-        # then read the file as "metafile" in
-        with open(item) as csvfile:
-            metafile_reader = csv.reader(csvfile, delimiter=',', quotechar='"')
-            metafile = [line for line in metafile_reader]
-    # check which of the three possible metafiles it is
-    # and process them accordingly.
-    # check case insensitive whether the metafile
-    # contains the light/dark information
-        if (('light' in pathlib_item.name.lower())
-                or ('dark' in pathlib_item.name.lower())):
-            light_dark_meta = [
-                               [float(border), light]
-                               for border, light in metafile[6:]]
-    # or the treatment and wellplate position information
-        elif ('wellplate' in pathlib_item.name.lower()):
-            wellplate, treatment = process_wellplate_metafile(metafile)
-            treatment = replace_wellplate_treatments(wellplate, treatment)
-            #treatment = (
-            #            replace_wellplate_treatments(
-            #                            process_wellplate_metafile(metafile)))
-    # or the general metainformations (hpf, etc.)
-        elif ('expdesign' in pathlib_item.name.lower()):
-            exp_design_meta = compress_list(metafile[6:])
-    # if 'meta' is not in the filename, it is recognized as a raw data file and
-    # appended in the fishmovement_list
-    elif (('.txt' in item) and ('hardware' not in item.lower())):
-        fishmovement_file_paths.append(item)
-
-# logical check whether less than 96 files were detected, indicating
-# some files might have been forgotten to be inserted in the folder
-if len(fishmovement_file_paths) < 96:
-    print("Are you sure, all fish files are in the folder and the names are "
-          "correctly formatted? I register < 96 fishfiles")
-    input("Press Enter to continue...")
-# store informations about hpf and the replicate_ID in a variable
-hpf = exp_design_meta[1]
-replicate = exp_design_meta[3]
-
-for idx, filepath in enumerate(fishmovement_file_paths):
-    # print the filenumber which is being processed on the display
-    print("processing file {} of {}.".format(
-        idx+1, len(fishmovement_file_paths)))
+# read the metafiles of the folder and collect the paths of the raw data
+# files. Returns the light/dark borders, the treatment of every well, the
+# general metainformation (hpf, replicate) and the raw data file paths
+def read_folder(folder):
+    # get the paths of all files located in the folder in a list
+    operating_path = pathlib.Path(folder)
+    files_path_list = [file_path.as_posix()
+                       for file_path in operating_path.glob('*')]
+    # an empty list to append the paths of the raw files for each fish
+    fishmovement_file_paths = []
+
+    # iterate through all files in the folder
+    for item in files_path_list:
+        pathlib_item = pathlib.Path(item)
+        # check if 'meta' is in a case-insensitive version of the filename
+        if ('meta' in pathlib_item.name.lower()):
+            # then read the file as "metafile" in
+            with open(item) as csvfile:
+                metafile_reader = csv.reader(csvfile, delimiter=',',
+                                             quotechar='"')
+                metafile = [line for line in metafile_reader]
+        # check which of the three possible metafiles it is
+        # and process them accordingly.
+        # check case insensitive whether the metafile
+        # contains the light/dark information
+            if (('light' in pathlib_item.name.lower())
+                    or ('dark' in pathlib_item.name.lower())):
+                light_dark_meta = [
+                                   [float(border), light]
+                                   for border, light in metafile[6:]]
+        # or the treatment and wellplate position information
+            elif ('wellplate' in pathlib_item.name.lower()):
+                wellplate, treatment = process_wellplate_metafile(metafile)
+                treatment = replace_wellplate_treatments(wellplate, treatment)
+        # or the general metainformations (hpf, etc.)
+            elif ('expdesign' in pathlib_item.name.lower()):
+                exp_design_meta = compress_list(metafile[6:])
+        # if 'meta' is not in the filename, it is recognized as a raw data
+        # file and appended in the fishmovement_list (except the list of
+        # outliers written by the outlier script)
+        elif (('.txt' in item) and ('hardware' not in item.lower())
+                and (pathlib_item.name != 'outliers.txt')):
+            fishmovement_file_paths.append(item)
+
+    return light_dark_meta, treatment, exp_design_meta, fishmovement_file_paths
+
+
+# read one raw data file into a dataframe with the trial time and the
+# distance moved as floats. Returns the dataframe and the header lines
+def parse_raw_file(filepath):
     # read in the csv file
-    temp = read_in_file(filepath)
-    df, header = format_data_into_dataframe(temp)
-    # subset the dataframe to df2 keeping only the columns which are necessary
-    df2 = df[['Trial_time', 'Distance_moved']].copy()
-    # format trial time+Distance moved into floats
-    df2 = format_values(df2)
-    # insert units into the column labels
-    df2 = update_column_labels(df2)
+    with ldt_profiling.step('read_in_file',
+                            nbytes=os.path.getsize(filepath)) as record:
+        temp = read_in_file(filepath)
+        record['rows'] = len(temp)
+    with ldt_profiling.step('format_data_into_dataframe', rows=len(temp)):
+        df, header = format_data_into_dataframe(temp)
+        # subset the dataframe to df2 keeping only the necessary columns
+        df2 = df[['Trial_time', 'Distance_moved']].copy()
+        # format trial time+Distance moved into floats
+        df2 = format_values(df2)
+        # insert units into the column labels
+        df2 = update_column_labels(df2)
+
+    return df2, header
+
+
+# add the light conditions, the individuum, its treatment and its ID to the
+# dataframe of one raw data file
+def annotate_fish(df2, header, light_dark_meta, treatment, hpf, replicate):
     # insert the meta information about light/dark times
-    df2 = insert_lighton_lightoff(df2, light_dark_meta)
+    with ldt_profiling.step('insert_lighton_lightoff', rows=len(df2)):
+        df2 = insert_lighton_lightoff(df2, light_dark_meta)
 
     # 1. get the Individuum number the raw data file describes
     # +1 to make the range from 1 to 96 instead of 0 to 95
+    # (or 1 to 24/48 for smaller wellplates)
     individuum_number = int(header[6][1])+1
     # and set it as a new column
     df2['Individuum'] = individuum_number
 
-    # 2. add new columns containing info about the treatment to the dataframe
+    # 2. add new columns containing info about the treatment
     Concentration_Substance = treatment[individuum_number-1].split(' ')
     # replace ',' in the concentration with '.'
     df2['Concentration'] = Concentration_Substance[0].replace(',', '.')
@@ -265,11 +270,80 @@ for idx, filepath in enumerate(fishmovement_file_paths):
             # + the ID of the replicate
             + str(replicate))
             )
-    # then the processed information is appended to the big data-dataframe
-    data = data.append(df2)
-    # and the next raw file will be processed and appended the same way
-print("Writing the dataframe onto the harddisk...")
-# save the pandas dataframe containing all processed informations of the folder
-# as a csv in the folder with the replicate name
-data.to_csv(f"Behaviour_df_{replicate}.csv",
-            sep=',', index=False, na_rep='nan')
+
+    return df2
+
+
+# append the processed information of one fish to the big dataframe
+def append_fish(data, df2):
+    with ldt_profiling.step('append', rows=len(df2)):
+        data = data.append(df2)
+
+    return data
+
+
+# save the pandas dataframe containing all processed informations of the
+# folder as a csv in the folder with the replicate name
+def write_behaviour_dataframe(data, folder, replicate, precision=None,
+                              compression=None):
+    with ldt_profiling.step('to_csv', rows=len(data)) as record:
+        output_path = ldt_io.write_csv(
+            data, pathlib.Path(folder) / f"Behaviour_df_{replicate}.csv",
+            index=False, na_rep='nan', precision=precision,
+            compression=compression, round_columns=['Distance_moved [mm]'])
+        record['bytes'] = os.path.getsize(output_path)
+
+    return output_path
+
+
+# combine all raw data files in the folder with the metainformation and write
+# the resulting dataframe as csv into the folder. The path of the csv is
+# returned. If interactive is False, the script doesn't wait for the user
+# when less fish files than wells were found. The distances moved are
+# rounded to "precision" decimal places and the csv compressed with
+# "compression" ('gzip' or 'zstd'), see ldt_io
+def main(folder, interactive=True, precision=None, compression=None):
+    light_dark_meta, treatment, exp_design_meta, fishmovement_file_paths = (
+        read_folder(folder))
+    # generate an empty dataframe where all fish_files will be stored in
+    data = pd.DataFrame()
+
+    # logical check whether less files than wells of the wellplate (e.g. 24,
+    # 48 or 96) were detected, indicating some files might have been
+    # forgotten to be inserted in the folder
+    if len(fishmovement_file_paths) < len(treatment):
+        print("Are you sure, all fish files are in the folder and the names "
+              "are correctly formatted? I register {} fishfiles for {} wells"
+              .format(len(fishmovement_file_paths), len(treatment)))
+        if interactive:
+            input("Press Enter to continue...")
+    # store informations about hpf and the replicate_ID in a variable
+    hpf = exp_design_meta[1]
+    replicate = exp_design_meta[3]
+
+    for idx, filepath in enumerate(fishmovement_file_paths):
+        # print the filenumber which is being processed on the display
+        print("processing file {} of {}.".format(
+            idx+1, len(fishmovement_file_paths)))
+        df2, header = parse_raw_file(filepath)
+        df2 = annotate_fish(df2, header, light_dark_meta, treatment, hpf,
+                            replicate)
+        # then the processed information is appended to the big dataframe
+        data = append_fish(data, df2)
+        # and the next raw file will be processed and appended the same way
+    print("Writing the dataframe onto the harddisk...")
+
+    return write_behaviour_dataframe(data, folder, replicate, precision,
+                                     compression)
+
+
+if __name__ == '__main__':
+    # set the path where the script is located as the current working
+    # directory
+    script_location = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_location)
+    # and print it out for control
+    print("operating in datapath {} ".format(os.getcwd()))
+    precision = None  # decimal places of the values, None keeps all digits
+    compression = None  # None, 'gzip' or 'zstd'
+    main(os.getcwd(), precision=precision, compression=compression)
@@ -19,6 +19,9 @@ import pathlib
 import os
 import csv
 
+import ldt_io
+import ldt_profiling
+
 
 # set up a multiindex containing Trial time and ID for the dataframe
 def set_indices(df):
@@ -60,44 +63,77 @@ def rearrange_columns(df):
     return df
 
 
-threshold = 750  # > 750 mm per minute moved will be determined as outlier
-                 # (1500 window width = 60 seconds)
-# set the location of the script as the current working directory
-script_location = os.path.dirname(os.path.abspath(__file__))
-os.chdir(script_location)
-# and create a pathlib path of the working directory
-path = pathlib.Path(os.getcwd())
-#
-pathcontainer = [filepath for filepath in path.glob('**/*.csv')
-                 if (('_processed' not in filepath.name)
-                     & (
-                        ('_R_' in filepath.name)
-                        | ('_Replikat_' in filepath.name)
-                        ))]
-
-for counter, file in enumerate(pathcontainer):
-    print("processing file number {} of {}"
-          .format(counter+1, len(pathcontainer)))
-    # read in the file
-    df = pd.read_csv(file)
-    # update all the indices of the dataframe for further analysis
-    df2 = set_indices(df)
-    # identify and remove the outliers which
-    # have more than 750 mm movement within a minute
-    outliers, df2 = remove_outliers(threshold, df2)
-    # check if any outliers exist
-    if outliers.any():
-        print("removed the fishs {} due to Movement > {}mm within a minute"
-              .format(outliers, threshold))
-        # and write them into the file "outliers.txt"
-        with open('outliers.txt', 'w', newline='') as outlierfile:
-            writer = csv.writer(outlierfile, delimiter=',')
-            # format outliers as list to be iterable
-            for line in [outliers]:
-                writer.writerow(line)
-
-    df2 = rearrange_columns(df2)
-    # write the dataframe to csv without the index (Trial time)
-    print("writing {} to the harddisk".format(df2.ID[10]))
-    df2.to_csv(file.stem+'_wo_outliers.csv',
-               sep=',', index=False)
+# remove the outliers from every behaviour dataframe of the import script
+# found in the folder (or the ones given in file_paths) and write the
+# results as csv into the folder. The distances moved are rounded to
+# "precision" decimal places and the csv compressed with "compression"
+# ('gzip' or 'zstd'), see ldt_io. The paths of the csv files are returned
+def main(folder, threshold=750, file_paths=None, precision=None,
+         compression=None):
+    # create a pathlib path of the folder
+    path = pathlib.Path(folder)
+    #
+    if file_paths is None:
+        pathcontainer = [filepath for filepath
+                         in ldt_io.glob_csv(path, '**/*')
+                         if (('_processed' not in filepath.name)
+                             & (
+                                ('_R_' in filepath.name)
+                                | ('_Replikat_' in filepath.name)
+                                ))]
+    else:
+        pathcontainer = [pathlib.Path(filepath) for filepath in file_paths]
+    output_paths = []
+
+    for counter, file in enumerate(pathcontainer):
+        print("processing file number {} of {}"
+              .format(counter+1, len(pathcontainer)))
+        # read in the file
+        with ldt_profiling.step('read_csv',
+                                nbytes=os.path.getsize(file)) as record:
+            df = ldt_io.read_csv(file)
+            record['rows'] = len(df)
+        # update all the indices of the dataframe for further analysis
+        with ldt_profiling.step('set_indices', rows=len(df)):
+            df2 = set_indices(df)
+        # identify and remove the outliers which
+        # have more than 750 mm movement within a minute
+        with ldt_profiling.step('remove_outliers', rows=len(df2)):
+            outliers, df2 = remove_outliers(threshold, df2)
+        # check if any outliers exist
+        if outliers.any():
+            print("removed the fishs {} due to Movement > {}mm within a "
+                  "minute".format(outliers, threshold))
+            # and write them into the file "outliers.txt"
+            with open(path / 'outliers.txt', 'w',
+                      newline='') as outlierfile:
+                writer = csv.writer(outlierfile, delimiter=',')
+                # format outliers as list to be iterable
+                for line in [outliers]:
+                    writer.writerow(line)
+
+        with ldt_profiling.step('rearrange_columns', rows=len(df2)):
+            df2 = rearrange_columns(df2)
+        # write the dataframe to csv without the index (Trial time)
+        print("writing {} to the harddisk".format(df2.ID[10]))
+        with ldt_profiling.step('to_csv', rows=len(df2)) as record:
+            output_path = ldt_io.write_csv(
+                df2, path / (ldt_io.csv_stem(file)+'_wo_outliers.csv'),
+                index=False, precision=precision, compression=compression,
+                round_columns=['Distance_moved [mm]'])
+            record['bytes'] = os.path.getsize(output_path)
+        output_paths.append(output_path)
+
+    return output_paths
+
+
+if __name__ == '__main__':
+    threshold = 750  # > 750 mm per minute moved will be determined as outlier
+                     # (1500 window width = 60 seconds)
+    # set the location of the script as the current working directory
+    script_location = os.path.dirname(os.path.abspath(__file__))
+    os.chdir(script_location)
+    precision = None  # decimal places of the values, None keeps all digits
+    compression = None  # None, 'gzip' or 'zstd'
+    main(os.getcwd(), threshold, precision=precision,
+         compression=compression)
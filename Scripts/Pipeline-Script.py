@@ -0,0 +1,379 @@
+"""
+This script runs the four scripts
+1. Import script
+2. Outlier script
+3. Filtering script
+4. Analysis script
+(and the optional feature script) established to analyse the output of the
+Light/Dark transition test as one pipeline. The experiment folder contains
+one subfolder per replicate (wellplate) with the raw data files and the
+metafiles. Import and outlier script run for every replicate folder, in
+parallel, the other scripts once for the whole experiment folder.
+In campaign mode, every plate folder found anywhere within the campaign
+folder is processed by a pool of workers as an independent shard, and the
+results of all plates are merged into one store keyed by plate and well
+("Campaign_store.sqlite") instead of being filtered and clustered.
+Every stage remembers a fingerprint of its inputs, parameters and script in
+the file ".pipeline_cache.json" of the experiment folder and is skipped if
+nothing changed since its last run and its outputs still exist.
+
+Usage: python Pipeline-Script.py <experiment folder> --clusters 4
+       python Pipeline-Script.py <campaign folder> --campaign
+
+It was developed at the Computational Ecology working group,
+Institute for Environmental Research, Biology V, RWTH Aachen.
+
+For questions please contact: dominik.ziaja@rwth-aachen.de
+"""
+
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import pathlib
+import re
+
+import ldt_io
+import ldt_profiling
+import ldt_tools
+
+
+CACHE_FILENAME = '.pipeline_cache.json'
+
+
+def run_import(module, folder, input_paths, params):
+    return [module.main(folder, interactive=False,
+                        precision=params['precision'],
+                        compression=params['compression'])]
+
+
+def run_outlier(module, folder, input_paths, params):
+    return module.main(folder, params['threshold'], file_paths=input_paths,
+                       precision=params['precision'],
+                       compression=params['compression'])
+
+
+def run_features(module, folder, input_paths, params):
+    return [module.main(folder, datafile_paths=input_paths,
+                        movement_threshold=params['movement_threshold'],
+                        response_window=params['response_window'],
+                        peak_window=params['peak_window'])]
+
+
+def run_filtering(module, folder, input_paths, params):
+    return module.main(folder, datafile_paths=input_paths,
+                       window=params['window'],
+                       incremental=params['incremental'],
+                       fill_gaps=params['fill_gaps'],
+                       precision=params['precision'],
+                       compression=params['compression'])
+
+
+def run_analysis(module, folder, input_paths, params):
+    # the unfiltered dataframe of the filtering script is not clustered
+    path_list = [path for path in input_paths
+                 if re.search('_moving_|_features', path.name)]
+    return module.main(folder, path_list=path_list,
+                       amount_cluster=params['amount_cluster'])
+
+
+def run_shard(module, folder, input_paths, params):
+    return [module.write_shard(folder / module.SHARD_FILENAME, folder.name,
+                               input_paths)]
+
+
+def run_store(module, folder, input_paths, params):
+    # every plate is named after its folder within the campaign folder
+    plates = [path.parent.relative_to(folder).as_posix()
+              for path in input_paths]
+    return [module.merge_shards(folder / module.STORE_FILENAME, input_paths,
+                                plates)]
+
+
+# the pipeline as a graph: every stage names the script it runs, the stages
+# whose outputs are its inputs ('after') and the parameters it depends on.
+# Stages with the scope 'replicate' run once per replicate folder, stages
+# with the scope 'experiment' once for the whole experiment folder.
+# Stages with 'campaign' set only run in campaign mode, the others only in
+# the normal mode (stages without 'campaign' run in both)
+STAGES = {
+    'import': {'script': 'Import-Script.py', 'run': run_import,
+               'after': [], 'scope': 'replicate',
+               'params': ['precision', 'compression']},
+    'outlier': {'script': 'Outlier-Script.py', 'run': run_outlier,
+                'after': ['import'], 'scope': 'replicate',
+                'params': ['threshold', 'precision', 'compression']},
+    'features': {'script': 'Feature-Script.py', 'run': run_features,
+                 'after': ['outlier'], 'scope': 'experiment',
+                 'campaign': False,
+                 'params': ['movement_threshold', 'response_window',
+                            'peak_window']},
+    'filtering': {'script': 'Filtering-Script.py', 'run': run_filtering,
+                  'after': ['outlier'], 'scope': 'experiment',
+                  'campaign': False,
+                  'params': ['window', 'incremental', 'fill_gaps',
+                             'precision', 'compression']},
+    'analysis': {'script': 'Analysis-Script.py', 'run': run_analysis,
+                 'after': ['filtering', 'features'], 'scope': 'experiment',
+                 'campaign': False,
+                 'params': ['amount_cluster']},
+    'shard': {'script': 'ldt_store.py', 'run': run_shard,
+              'after': ['outlier'], 'scope': 'replicate',
+              'campaign': True,
+              'params': []},
+    'store': {'script': 'ldt_store.py', 'run': run_store,
+              'after': ['shard'], 'scope': 'experiment',
+              'campaign': True,
+              'params': []},
+}
+
+
+# the stages of the normal or the campaign mode
+def select_stages(stages, campaign):
+    return {stage: description for stage, description in stages.items()
+            if description.get('campaign', campaign) == campaign}
+
+
+# order the stages so every stage comes after the stages it depends on
+def sort_stages(stages):
+    ordered = []
+    visiting = set()
+
+    def visit(stage):
+        if stage in ordered:
+            return
+        if stage in visiting:
+            raise ValueError(f"The pipeline contains a cycle at {stage}")
+        visiting.add(stage)
+        for dependency in stages[stage]['after']:
+            visit(dependency)
+        visiting.discard(stage)
+        ordered.append(stage)
+
+    for stage in stages:
+        visit(stage)
+
+    return ordered
+
+
+# every folder containing an expdesign metafile is a replicate (plate)
+# folder, no matter how deep it is located within the experiment folder
+def find_replicate_folders(root):
+    return sorted({item.parent for item in root.rglob('*')
+                   if item.is_file()
+                   and ('meta' in item.name.lower())
+                   and ('expdesign' in item.name.lower())})
+
+
+# the raw data files and metafiles the import script reads in a folder
+def find_raw_inputs(folder):
+    return sorted(item for item in folder.iterdir()
+                  if item.is_file()
+                  and (('meta' in item.name.lower())
+                       or (item.suffix == '.txt'
+                           and 'hardware' not in item.name.lower()
+                           and item.name != 'outliers.txt')))
+
+
+def load_cache(root):
+    cache_path = root / CACHE_FILENAME
+    if cache_path.exists():
+        with open(cache_path) as cachefile:
+            return json.load(cachefile)
+    return {}
+
+
+def save_cache(root, cache):
+    with open(root / CACHE_FILENAME, 'w') as cachefile:
+        json.dump(cache, cachefile, indent=1, sort_keys=True)
+
+
+# the fingerprint of a stage combines the script, the helper modules
+# (ldt_*.py) the scripts import, the parameters and the fingerprint of every
+# input file. If one of them changes, so does the fingerprint and the stage
+# has to run again
+def stage_fingerprint(root, stage, input_paths, stage_params):
+    description = {
+        'script': ldt_tools.hash_file(
+            ldt_tools.SCRIPT_FOLDER / STAGES[stage]['script']),
+        'helpers': {path.name: ldt_tools.hash_file(path) for path
+                    in sorted(ldt_tools.SCRIPT_FOLDER.glob('ldt_*.py'))},
+        'params': stage_params,
+        'inputs': [ldt_tools.file_fingerprint(path, root)
+                   for path in input_paths],
+        }
+    encoded = json.dumps(description, sort_keys=True).encode()
+
+    return hashlib.sha256(encoded).hexdigest()
+
+
+# the cached outputs are still valid if they all exist and weren't changed
+def outputs_unchanged(root, outputs):
+    for name, size, mtime in outputs:
+        path = root / name
+        if (not path.exists()
+                or ldt_tools.file_fingerprint(path, root) != [name, size,
+                                                              mtime]):
+            return False
+    return True
+
+
+# run one stage in one folder, unless its cached outputs are still valid.
+# Returns the output paths and the new cache entries
+def run_stage(root, folder, stage, input_paths, params, cache, force):
+    key = f"{stage}:{folder.relative_to(root).as_posix()}"
+    stage_params = {name: params[name] for name in STAGES[stage]['params']}
+    fingerprint = stage_fingerprint(root, stage, input_paths, stage_params)
+    entry = cache.get(key)
+    if (not force and entry is not None
+            and entry['fingerprint'] == fingerprint
+            and outputs_unchanged(root, entry['outputs'])):
+        print(f"{key} is up to date, skipping it.")
+        return [root / name for name, _, _ in entry['outputs']], {}
+
+    print(f"running {key}.")
+    module = ldt_tools.load_script(STAGES[stage]['script'])
+    with ldt_profiling.step(f"stage {stage}"):
+        output_paths = STAGES[stage]['run'](module, folder, input_paths,
+                                            stage_params)
+    output_paths = [pathlib.Path(path) for path in output_paths]
+    entry = {'fingerprint': fingerprint,
+             'outputs': [ldt_tools.file_fingerprint(path, root)
+                         for path in output_paths]}
+
+    return output_paths, {key: entry}
+
+
+# run all replicate stages for one replicate folder, one after another.
+# Runs in a worker process, thus the cache entries are returned and
+# written by the main process
+def run_replicate(root, folder, stages, params, cache, force):
+    outputs = {}
+    entries = {}
+    for stage in stages:
+        if STAGES[stage]['after']:
+            input_paths = sorted(path for dependency in STAGES[stage]['after']
+                                 for path in outputs[dependency])
+        else:
+            input_paths = find_raw_inputs(folder)
+        outputs[stage], new_entries = run_stage(root, folder, stage,
+                                                input_paths, params, cache,
+                                                force)
+        entries.update(new_entries)
+
+    return outputs, entries
+
+
+def run_pipeline(root, params, workers=None, force=False, campaign=False):
+    root = pathlib.Path(root).resolve()
+    cache = load_cache(root)
+    order = sort_stages(select_stages(STAGES, campaign))
+    replicate_stages = [stage for stage in order
+                        if STAGES[stage]['scope'] == 'replicate']
+    experiment_stages = [stage for stage in order
+                         if STAGES[stage]['scope'] == 'experiment']
+    replicate_folders = find_replicate_folders(root)
+    print(f"found {len(replicate_folders)} replicate folders in {root}.")
+    # collect the outputs of each stage over all replicates
+    outputs = {stage: [] for stage in order}
+
+    # the replicates are independent of each other and run concurrently,
+    # by default one worker per core. The cores are shared by the workers,
+    # so each one formats its csv files with its share of the cores only
+    workers = workers or os.cpu_count() or 1
+    os.environ[ldt_io.WORKERS_VARIABLE] = str(
+        max(1, (os.cpu_count() or 1) // workers))
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=workers) as executor:
+            futures = [executor.submit(run_replicate, root, folder,
+                                       replicate_stages, params, cache, force)
+                       for folder in replicate_folders]
+            for future in concurrent.futures.as_completed(futures):
+                replicate_outputs, entries = future.result()
+                for stage, paths in replicate_outputs.items():
+                    outputs[stage].extend(paths)
+                cache.update(entries)
+                save_cache(root, cache)
+    # the stages of the whole experiment run alone and use all cores again
+    finally:
+        os.environ.pop(ldt_io.WORKERS_VARIABLE, None)
+
+    for stage in experiment_stages:
+        # sorted, so the order of the inputs doesn't depend on which
+        # replicate finished first
+        input_paths = sorted(path for dependency in STAGES[stage]['after']
+                             for path in outputs[dependency])
+        outputs[stage], entries = run_stage(root, root, stage, input_paths,
+                                            params, cache, force)
+        cache.update(entries)
+        save_cache(root, cache)
+
+    return outputs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Run the Light/Dark transition test analysis pipeline.")
+    parser.add_argument('folder',
+                        help="experiment folder with one subfolder per "
+                             "replicate")
+    parser.add_argument('--clusters', type=int, default=None,
+                        help="amount of clusters of the analysis")
+    parser.add_argument('--campaign', action='store_true',
+                        help="merge all plates into one store instead of "
+                             "filtering and clustering them")
+    parser.add_argument('--threshold', type=float, default=750,
+                        help="mm moved per minute above which a fish is an "
+                             "outlier")
+    parser.add_argument('--window', type=int, default=12000,
+                        help="window width of the moving filters")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only add new replicates to the results of the "
+                             "filtering script instead of combining all "
+                             "replicates again (implies --fill-gaps)")
+    parser.add_argument('--fill-gaps', action='store_true',
+                        help="fill the gaps of each fish by interpolation "
+                             "in the filtering script instead of dropping "
+                             "their time points for all fish")
+    parser.add_argument('--movement-threshold', type=float, default=0.1,
+                        help="mm per value above which a fish is moving")
+    parser.add_argument('--response-window', type=float, default=60,
+                        help="seconds after a transition the response is "
+                             "searched in")
+    parser.add_argument('--peak-window', type=int, default=25,
+                        help="amount of values the response is summed over")
+    parser.add_argument('--precision', type=int, default=None,
+                        help="decimal places of the values in the csv files "
+                             "of import, outlier and filtering script")
+    parser.add_argument('--compression', default=None,
+                        choices=['gzip', 'zstd'],
+                        help="compress the csv files of import, outlier and "
+                             "filtering script")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="amount of replicates processed in parallel")
+    parser.add_argument('--force', action='store_true',
+                        help="run every stage, even if it is up to date")
+    parser.add_argument('--profile', nargs='?', const='1', default=None,
+                        help="record the performance of every step as json "
+                             "lines in the given file")
+    args = parser.parse_args()
+    if args.clusters is None and not args.campaign:
+        parser.error("--clusters is required unless --campaign is given")
+
+    if args.profile is not None:
+        print("profiling into {}".format(ldt_profiling.enable(args.profile)))
+
+    params = {'threshold': args.threshold,
+              'window': args.window,
+              'incremental': args.incremental,
+              'fill_gaps': args.fill_gaps,
+              'precision': args.precision,
+              'compression': args.compression,
+              'movement_threshold': args.movement_threshold,
+              'response_window': args.response_window,
+              'peak_window': args.peak_window,
+              'amount_cluster': args.clusters}
+    run_pipeline(args.folder, params, workers=args.workers, force=args.force,
+                 campaign=args.campaign)
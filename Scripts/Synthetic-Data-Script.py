@@ -0,0 +1,212 @@
+"""
+This script generates synthetic experiments for the four scripts
+1. Import script
+2. Outlier script
+3. Filtering script
+4. Analysis script
+established to analyse the output of the Light/Dark transition test.
+It writes raw data files in the format of the DanioVision chambers output
+(35 header lines, ';' separated, '-' for values where the fish was lost)
+together with the three metafiles (wellplate, light/dark and expdesign) for
+every replicate, so the scripts can be tested and benchmarked without real
+experiments. Plate size, trial length and frame rate can be chosen freely.
+
+Usage: python Synthetic-Data-Script.py <folder> --wells 96 --replicates 2
+
+It was developed at the Computational Ecology working group,
+Institute for Environmental Research, Biology V, RWTH Aachen.
+
+For questions please contact: dominik.ziaja@rwth-aachen.de
+"""
+
+import argparse
+import csv
+import pathlib
+
+import numpy as np
+
+
+# amount of rows and columns of the supported wellplate formats
+WELLPLATE_FORMATS = {24: (4, 6), 48: (6, 8), 96: (8, 12)}
+
+# column names (line 34) and units (line 35) of the raw data files
+RAW_COLUMNS = ['Trial time', 'Recording time', 'X center', 'Y center',
+               'Distance moved', 'Velocity', 'Result 1']
+RAW_UNITS = ['s', 's', 'mm', 'mm', 'mm', 'mm/s', '']
+
+
+# the first 6 lines of every metafile are skipped by the import script
+def metafile_header(title, experiment_name):
+    return [[title], ['Experiment', experiment_name],
+            ['Generated by', 'Synthetic-Data-Script'],
+            ['Comment', 'synthetic data'], ['Version', '1'], []]
+
+
+def write_metafile(path, rows):
+    with open(path, 'w', newline='') as metafile:
+        writer = csv.writer(metafile, delimiter=',', quotechar='"')
+        writer.writerows(rows)
+
+
+# write the wellplate metafile: first the treatments as "#1_0 mg/L Substance"
+# then the number of the treatment of every well, one row per wellplate row.
+# The treatments are assigned in blocks of columns, as evenly as the amount
+# of columns allows
+def write_wellplate_metafile(path, experiment_name, wells, treatments):
+    n_rows, n_columns = WELLPLATE_FORMATS[wells]
+    rows = metafile_header('Metafile wellplate', experiment_name)
+    for number, treatment in enumerate(treatments, 1):
+        rows.append([f"#{number}_{treatment}"])
+    treatment_numbers = (np.arange(n_columns) * len(treatments)
+                         // n_columns) + 1
+    for _ in range(n_rows):
+        rows.append([str(number) for number in treatment_numbers])
+    write_metafile(path, rows)
+
+    return np.tile(treatment_numbers, n_rows) - 1
+
+
+def write_light_dark_metafile(path, experiment_name, light_dark_schedule):
+    rows = metafile_header('Metafile light dark', experiment_name)
+    rows += [[f"{border:g}", light] for border, light in light_dark_schedule]
+    write_metafile(path, rows)
+
+
+def write_expdesign_metafile(path, experiment_name, hpf, replicate):
+    rows = metafile_header('Metafile expdesign', experiment_name)
+    rows += [['hpf', hpf], ['Replicate', replicate]]
+    write_metafile(path, rows)
+
+
+# alternating light and dark phases of phase_length seconds,
+# starting with the light on
+def light_dark_schedule(trial_length, phase_length):
+    borders = np.arange(0, trial_length, phase_length)
+    return [(border, 'Light on' if idx % 2 == 0 else 'Light off')
+            for idx, border in enumerate(borders)]
+
+
+# simulate the distance moved per frame of one fish. The fish is moving with
+# a low probability in the light, and with a high probability after the
+# light was switched off, which decays during the dark phase (habituation).
+# The effect scales the activity of the treatment (1 = negative control)
+def simulate_distance(trial_time, light_on, effect, rng, gap_probability):
+    # time since the last transition
+    transition = np.r_[True, light_on[1:] != light_on[:-1]]
+    phase_start = np.maximum.accumulate(np.where(transition, trial_time, 0))
+    phase_time = trial_time - phase_start
+    activity = np.where(light_on, 0.1,
+                        0.3 + 0.5 * np.exp(-phase_time / 120))
+    activity = np.clip(activity * effect * rng.uniform(0.7, 1.3), 0, 1)
+    moving = rng.random(len(trial_time)) < activity
+    distance = np.where(moving, rng.gamma(2.0, 0.4, len(trial_time)), 0.0)
+    # frames where the fish was lost by the camera, always the first frame
+    lost = rng.random(len(trial_time)) < gap_probability
+    lost[0] = True
+
+    return distance, lost
+
+
+# write one raw data file in the format of the DanioVision chambers output.
+# The arena number (0-based) is in line 7, the column names in line 34
+def write_raw_file(path, arena, experiment_name, trial_time, distance, lost,
+                   rng):
+    header = [['Number of header lines:', '35'],
+              ['Experiment:', experiment_name],
+              ['Trial name:', 'Trial     1'],
+              ['Trial ID:', '1'],
+              ['Arena name:', f'Arena {arena + 1}'],
+              ['Subject name:', 'Subject 1'],
+              ['Arena ID:', str(arena)],
+              ['Subject ID:', '1']]
+    header += [[f'Setting {idx}:', '-'] for idx in range(len(header), 33)]
+    header += [RAW_COLUMNS, RAW_UNITS]
+    # a random walk of the position, consistent with the distance moved
+    angle = rng.uniform(0, 2 * np.pi, len(distance))
+    x_center = np.cumsum(distance * np.cos(angle))
+    y_center = np.cumsum(distance * np.sin(angle))
+    frame_duration = trial_time[1] - trial_time[0]
+    values = [np.char.mod('%.3f', trial_time),
+              np.char.mod('%.3f', trial_time),
+              np.char.mod('%.3f', x_center),
+              np.char.mod('%.3f', y_center),
+              np.char.mod('%.3f', distance),
+              np.char.mod('%.3f', distance / frame_duration),
+              np.full(len(distance), '1')]
+    # all values except the time are replaced with '-' if the fish was lost
+    for column in values[2:6]:
+        column[lost] = '-'
+
+    with open(path, 'w', newline='') as rawfile:
+        writer = csv.writer(rawfile, delimiter=';', quoting=csv.QUOTE_ALL)
+        writer.writerows(header)
+        writer.writerows(zip(*values))
+
+
+# generate a folder for every replicate, containing the raw data files of
+# every well and the three metafiles. Returns the replicate folders
+def main(folder, wells=96, replicates=1, trial_length=3600, frame_rate=25,
+         phase_length=600, substance='Cadmiumchlorid',
+         concentrations=('0', '2,5', '5', '10'), hpf='96',
+         gap_probability=0.001, seed=0):
+    if wells not in WELLPLATE_FORMATS:
+        raise ValueError(f"{wells} wells are not supported, use one of "
+                         f"{sorted(WELLPLATE_FORMATS)}")
+    rng = np.random.default_rng(seed)
+    folder = pathlib.Path(folder)
+    treatments = [f"{concentration} mg/L {substance}"
+                  for concentration in concentrations]
+    # the higher the concentration, the lower the activity
+    effects = np.linspace(1, 0.4, len(treatments))
+    schedule = light_dark_schedule(trial_length, phase_length)
+    trial_time = np.arange(0, trial_length, 1 / frame_rate)
+    light_on = np.zeros(len(trial_time), dtype=bool)
+    for border, light in schedule:
+        light_on[trial_time >= border] = (light == 'Light on')
+
+    replicate_folders = []
+    for replicate_number in range(1, replicates + 1):
+        replicate = f"R_{replicate_number}"
+        experiment_name = f"Synthetic LDT {replicate}"
+        replicate_folder = folder / replicate
+        replicate_folder.mkdir(parents=True, exist_ok=True)
+        print(f"writing replicate {replicate_number} of {replicates}.")
+        well_treatments = write_wellplate_metafile(
+            replicate_folder / 'Meta_wellplate.csv', experiment_name, wells,
+            treatments)
+        write_light_dark_metafile(replicate_folder / 'Meta_light_dark.csv',
+                                  experiment_name, schedule)
+        write_expdesign_metafile(replicate_folder / 'Meta_expdesign.csv',
+                                 experiment_name, hpf, replicate)
+        for arena in range(wells):
+            distance, lost = simulate_distance(
+                trial_time, light_on, effects[well_treatments[arena]], rng,
+                gap_probability)
+            write_raw_file(
+                replicate_folder
+                / f"Raw data-{experiment_name}-Trial 1-Arena {arena + 1}.txt",
+                arena, experiment_name, trial_time, distance, lost, rng)
+        replicate_folders.append(replicate_folder)
+
+    return replicate_folders
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Generate synthetic Light/Dark transition test data.")
+    parser.add_argument('folder', help="folder the replicates are written to")
+    parser.add_argument('--wells', type=int, default=96,
+                        choices=sorted(WELLPLATE_FORMATS))
+    parser.add_argument('--replicates', type=int, default=1)
+    parser.add_argument('--trial-length', type=float, default=3600,
+                        help="length of the trial in seconds")
+    parser.add_argument('--frame-rate', type=float, default=25,
+                        help="frames per second")
+    parser.add_argument('--phase-length', type=float, default=600,
+                        help="length of each light and dark phase in seconds")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    main(args.folder, wells=args.wells, replicates=args.replicates,
+         trial_length=args.trial_length, frame_rate=args.frame_rate,
+         phase_length=args.phase_length, seed=args.seed)
@@ -0,0 +1,195 @@
+"""
+This module reads and writes the csv files of the scripts
+established to analyse the output of the Light/Dark transition test.
+The tables are written in the same csv layout as pandas' to_csv, but the
+values are formatted to text by several processes in parallel, chunk by
+chunk, optionally rounded to an amount of decimal places. The text is
+streamed into the file, which can be compressed with gzip (".csv.gz") or
+zstd (".csv.zst", needs the package zstandard). The compression is chosen
+by the file ending, so the reader finds and decompresses the files on its
+own. If the package pyarrow is installed, it is used to parse the csv files
+with several threads.
+It needs to be located in the same folder as the scripts.
+
+It was developed at the Computational Ecology working group,
+Institute for Environmental Research, Biology V, RWTH Aachen.
+
+For questions please contact: dominik.ziaja@rwth-aachen.de
+"""
+
+import collections
+import concurrent.futures
+import gzip
+import importlib.util
+import multiprocessing
+import os
+import pathlib
+
+import pandas as pd
+
+try:
+    import zstandard
+except ImportError:  # zstd compression is optional
+    zstandard = None
+
+
+# file endings of the compressions, appended to ".csv"
+COMPRESSION_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst'}
+CSV_SUFFIXES = ('.csv', '.csv.gz', '.csv.zst')
+
+# compression level if none is given, a tradeoff between speed and size
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 3}
+
+# amount of values formatted by a worker at once. The amount of rows per
+# chunk depends on the amount of columns, so the long behaviour tables and
+# the wide fish x time matrices are split into chunks of similar size
+CHUNK_VALUES = 1000000
+
+# environment variable with the amount of processes formatting a csv file,
+# set by the pipeline for its workers so they share the cores
+WORKERS_VARIABLE = 'LDT_IO_WORKERS'
+
+# the arguments of read_csv the pyarrow parser supports
+PYARROW_ARGUMENTS = {'sep', 'header', 'index_col', 'usecols', 'names',
+                     'dtype', 'na_values'}
+
+# whether the (optional) pyarrow parser is installed. It is only looked up
+# here, pandas imports it when the first file is parsed with it
+PYARROW_AVAILABLE = importlib.util.find_spec('pyarrow') is not None
+
+
+# the compression of a file by its ending, None for plain csv files
+def compression_from_path(path):
+    for compression, suffix in COMPRESSION_SUFFIXES.items():
+        if str(path).endswith(suffix):
+            return compression
+    return None
+
+
+# the path of a csv file with the ending of the compression, e.g.
+# "Fish_behaviour_moving_average.csv.gz" for "gzip"
+def with_compression(path, compression):
+    if compression is None:
+        return pathlib.Path(path)
+    if compression not in COMPRESSION_SUFFIXES:
+        raise ValueError(f"{compression} is not supported, use one of "
+                         f"{', '.join(COMPRESSION_SUFFIXES)}")
+    return pathlib.Path(str(path) + COMPRESSION_SUFFIXES[compression])
+
+
+# the name of a csv file without its csv and compression ending
+def csv_stem(path):
+    name = pathlib.Path(path).name
+    for suffix in sorted(CSV_SUFFIXES, key=len, reverse=True):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return pathlib.Path(path).stem
+
+
+# all csv files in the folder matching the pattern, compressed or not,
+# e.g. glob_csv(folder, '*_wo_outliers') or glob_csv(folder, '**/*')
+def glob_csv(folder, pattern='*'):
+    return sorted(filepath for suffix in CSV_SUFFIXES
+                  for filepath in pathlib.Path(folder).glob(pattern + suffix))
+
+
+# open a csv file as text, (de)compressing it by its file ending.
+# mode is 'r', 'w' or 'a'
+def open_csv(path, mode='r', level=None):
+    compression = compression_from_path(path)
+    if compression == 'gzip':
+        return gzip.open(path, mode + 't', newline='', encoding='utf-8',
+                         compresslevel=level or DEFAULT_LEVELS['gzip'])
+    if compression == 'zstd':
+        if zstandard is None:
+            raise ImportError(f"{path} is compressed with zstd, which needs "
+                              "the package zstandard")
+        return zstandard.open(
+            path, mode + 't', encoding='utf-8', newline='',
+            cctx=zstandard.ZstdCompressor(
+                level=level or DEFAULT_LEVELS['zstd']))
+    return open(path, mode, newline='', encoding='utf-8')
+
+
+# the dataframe as csv text like to_csv returns it. The values are rounded
+# to "precision" decimal places beforehand (None keeps all digits), which
+# shortens the text without the slow float_format of to_csv. If
+# round_columns is given, only these columns are rounded, e.g. the measured
+# values but not the trial time or the concentration
+def format_csv(df, precision=None, round_columns=None, **options):
+    if precision is not None and round_columns is not None:
+        df = df.round({column: precision for column in round_columns})
+    elif precision is not None:
+        df = df.round(precision)
+    return df.to_csv(**options)
+
+
+# the amount of processes formatting a csv file if none is given: the value
+# of WORKERS_VARIABLE if it is set, one inside a worker process of another
+# pool (which already uses the other cores), otherwise one per core
+def default_workers():
+    if os.environ.get(WORKERS_VARIABLE):
+        return max(1, int(os.environ[WORKERS_VARIABLE]))
+    if multiprocessing.parent_process() is not None:
+        return 1
+    return os.cpu_count() or 1
+
+
+# format the values of a chunk of rows, runs in a worker
+def format_chunk(chunk, precision, round_columns, options):
+    return format_csv(chunk, precision, round_columns, header=False,
+                      **options)
+
+
+# write the dataframe into the csv file like to_csv does. The rows are split
+# into chunks which are formatted by "workers" processes (by default one per
+# core, see default_workers) and written in order. If compression is given,
+# its ending is appended to the path. mode 'a' appends the rows to an
+# existing file. precision and round_columns are the ones of format_csv.
+# The path of the written file is returned
+def write_csv(df, path, index=True, header=True, na_rep='', precision=None,
+              compression=None, level=None, workers=None, mode='w',
+              round_columns=None):
+    path = with_compression(path, compression)
+    options = {'sep': ',', 'index': index, 'na_rep': na_rep}
+    chunk_rows = max(1, CHUNK_VALUES // max(1, df.shape[1]))
+    chunks = (df.iloc[start:start + chunk_rows]
+              for start in range(0, len(df), chunk_rows))
+    workers = workers or default_workers()
+
+    with open_csv(path, mode, level) as csvfile:
+        if header:
+            csvfile.write(df.iloc[:0].to_csv(header=True, **options))
+        if workers == 1 or len(df) <= chunk_rows:
+            for chunk in chunks:
+                csvfile.write(format_chunk(chunk, precision, round_columns,
+                                           options))
+        else:
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=workers) as executor:
+                # only a few chunks are formatted ahead of the writing, so
+                # the text of the whole table is never held in the memory
+                pending = collections.deque()
+                for chunk in chunks:
+                    pending.append(executor.submit(format_chunk, chunk,
+                                                   precision, round_columns,
+                                                   options))
+                    if len(pending) > 2 * workers:
+                        csvfile.write(pending.popleft().result())
+                while pending:
+                    csvfile.write(pending.popleft().result())
+
+    return path
+
+
+# read a csv file written by write_csv (or to_csv) into a dataframe. The
+# arguments are the ones of pandas' read_csv. pyarrow parses the file if it
+# is installed and supports all arguments
+def read_csv(path, **kwargs):
+    compression = compression_from_path(path)
+    if compression == 'zstd':
+        with open_csv(path, 'r') as csvfile:
+            return pd.read_csv(csvfile, **kwargs)
+    if PYARROW_AVAILABLE and set(kwargs) <= PYARROW_ARGUMENTS:
+        return pd.read_csv(path, engine='pyarrow', **kwargs)
+    return pd.read_csv(path, **kwargs)
@@ -0,0 +1,186 @@
+"""
+This module measures the performance of the scripts
+established to analyse the output of the Light/Dark transition test.
+Every named step of a script (e.g. read_in_file, remove_outliers or a plot)
+records its wall time, CPU time, the resident memory (RSS) of the process
+before and after the step, their difference and the peak during the step
+(sampled by a thread), and, if known, its throughput in rows/s and MB/s.
+Profiling is switched off by default and only costs a function call per step
+then. It is switched on by setting the environment variable LDT_PROFILE to
+the path of the output file (or to 1 for a file named after the run), or by
+calling enable(). Every step is appended as one JSON object per line to the
+output file, so the steps of worker processes end up in the same file.
+It needs to be located in the same folder as the scripts.
+
+It was developed at the Computational Ecology working group,
+Institute for Environmental Research, Biology V, RWTH Aachen.
+
+For questions please contact: dominik.ziaja@rwth-aachen.de
+"""
+
+import contextlib
+import json
+import os
+import platform
+import sys
+import threading
+import time
+import uuid
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+# path of the output file, None while profiling is switched off
+_output_path = None
+
+# seconds between two samples of the resident memory during a step
+SAMPLE_INTERVAL = 0.01
+
+
+# switch profiling on. The settings are stored in the environment, so
+# processes started by the script (e.g. the pipeline workers) profile into
+# the same file with the same run ID
+def enable(output_path=None):
+    global _output_path
+    run_id = os.environ.setdefault('LDT_PROFILE_RUN',
+                                   time.strftime('%Y%m%d-%H%M%S-')
+                                   + uuid.uuid4().hex[:6])
+    if output_path is None or str(output_path) == '1':
+        output_path = f"ldt_profile_{run_id}.jsonl"
+    _output_path = os.path.abspath(output_path)
+    os.environ['LDT_PROFILE'] = _output_path
+
+    return _output_path
+
+
+def disable():
+    global _output_path
+    _output_path = None
+    os.environ.pop('LDT_PROFILE', None)
+
+
+def is_enabled():
+    return _output_path is not None
+
+
+# the highest resident memory of the process so far in MB
+def peak_rss_mb():
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on linux, bytes on macOS
+        return peak / 1024**2 if sys.platform == 'darwin' else peak / 1024
+    try:
+        import psutil
+    except ImportError:
+        return None
+    memory_info = psutil.Process().memory_info()
+    return getattr(memory_info, 'peak_wset', memory_info.rss) / 1024**2
+
+
+# the current resident memory of the process in MB
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 1024**2
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss / 1024**2
+
+
+# sample the resident memory until "stopped" is set, the highest value is
+# kept in peak[0]. Runs in a thread while a step is measured
+def _sample_rss(stopped, peak):
+    while not stopped.wait(SAMPLE_INTERVAL):
+        peak[0] = max(peak[0], rss_mb())
+
+
+# measure the resident memory while the block runs. The yielded dict is
+# filled with the memory before ('start') and after ('end') the block and the
+# peak in between ('peak', sampled by a thread), in MB or None if the memory
+# can't be measured, e.g.:
+#     with ldt_profiling.sample_rss() as memory:
+#         df = pd.read_csv(path)
+#     print(memory['peak'] - memory['start'])
+@contextlib.contextmanager
+def sample_rss():
+    memory = {'start': rss_mb(), 'end': None, 'peak': None}
+    peak = [memory['start']]
+    stopped = threading.Event()
+    if memory['start'] is not None:
+        sampler = threading.Thread(target=_sample_rss, args=(stopped, peak),
+                                   daemon=True)
+        sampler.start()
+    try:
+        yield memory
+    finally:
+        memory['end'] = rss_mb()
+        if memory['start'] is not None:
+            stopped.set()
+            sampler.join()
+            memory['peak'] = max(peak[0], memory['end'])
+
+
+def _write_record(record):
+    with open(_output_path, 'a') as outputfile:
+        outputfile.write(json.dumps(record) + '\n')
+
+
+# measure one step. The amount of rows and bytes processed can be given
+# beforehand or set in the yielded record. For tables the amount of values
+# (cells) can be given as well, e.g.:
+#     with ldt_profiling.step('read_in_file', nbytes=size) as record:
+#         data = read_in_file(path)
+#         record['rows'] = len(data)
+@contextlib.contextmanager
+def step(name, rows=None, nbytes=None, cells=None):
+    record = {'rows': rows, 'bytes': nbytes, 'cells': cells}
+    if _output_path is None:
+        yield record
+        return
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    try:
+        with sample_rss() as memory:
+            yield record
+    finally:
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        # numpy integers (e.g. DataFrame.size) can't be written as json
+        rows = int(record['rows']) if record['rows'] is not None else None
+        nbytes = int(record['bytes']) if record['bytes'] is not None else None
+        cells = int(record['cells']) if record['cells'] is not None else None
+        _write_record({
+            'run': os.environ.get('LDT_PROFILE_RUN'),
+            'script': os.path.basename(sys.argv[0]),
+            'host': platform.node(),
+            'pid': os.getpid(),
+            'step': name,
+            'timestamp': time.time(),
+            'wall_s': wall,
+            'cpu_s': cpu,
+            'rss_start_mb': memory['start'],
+            'rss_end_mb': memory['end'],
+            'rss_delta_mb': (memory['end'] - memory['start']
+                             if memory['start'] is not None else None),
+            'peak_rss_mb': memory['peak'],
+            'process_peak_rss_mb': peak_rss_mb(),
+            'rows': rows,
+            'cells': cells,
+            'mb': nbytes / 1e6 if nbytes is not None else None,
+            'rows_per_s': rows / wall if rows is not None and wall else None,
+            'mb_per_s': (nbytes / 1e6 / wall
+                         if nbytes is not None and wall else None),
+            })
+
+
+# profiling is switched on for the whole run if LDT_PROFILE is set
+if os.environ.get('LDT_PROFILE'):
+    enable(os.environ['LDT_PROFILE'])
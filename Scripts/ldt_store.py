@@ -0,0 +1,299 @@
+"""
+This module stores the output of the scripts
+established to analyse the output of the Light/Dark transition test
+in a SQLite database, keyed by plate and well. The metainformation of every
+fish is stored in the table "fish", its time series (trial time, distance
+moved, light on/off) as binary arrays in the table "series", so the series
+of a fish can be loaded without reading the ones of any other fish.
+The moving average/standard deviation of the filtering script are stored
+the same way in the table "filtered".
+Every plate is written into its own shard database by a worker process,
+the shards are merged into the store of the campaign afterwards.
+Fish can be selected by plate, substance, concentration, hpf and replicate;
+the selection is done by the database on the indexed metainformation, so
+only the series of the selected fish are read.
+It needs to be located in the same folder as the scripts.
+
+It was developed at the Computational Ecology working group,
+Institute for Environmental Research, Biology V, RWTH Aachen.
+
+For questions please contact: dominik.ziaja@rwth-aachen.de
+"""
+
+import collections
+import pathlib
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+import ldt_io
+
+
+SHARD_FILENAME = 'Plate_store.sqlite'
+STORE_FILENAME = 'Campaign_store.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fish (
+    plate TEXT NOT NULL,
+    well INTEGER NOT NULL,
+    id TEXT NOT NULL,
+    substance TEXT,
+    concentration REAL,
+    concentration_unit TEXT,
+    hpf TEXT,
+    replicate TEXT,
+    n_values INTEGER,
+    PRIMARY KEY (plate, well)
+);
+CREATE INDEX IF NOT EXISTS fish_treatment
+    ON fish (substance, concentration, hpf);
+CREATE INDEX IF NOT EXISTS fish_hpf ON fish (hpf);
+CREATE INDEX IF NOT EXISTS fish_replicate ON fish (replicate);
+CREATE TABLE IF NOT EXISTS series (
+    plate TEXT NOT NULL,
+    well INTEGER NOT NULL,
+    trial_time BLOB,
+    distance_moved BLOB,
+    light_on_off BLOB,
+    PRIMARY KEY (plate, well)
+);
+CREATE TABLE IF NOT EXISTS filtered (
+    plate TEXT NOT NULL,
+    well INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    trial_time BLOB,
+    vals BLOB,
+    PRIMARY KEY (plate, well, kind)
+);
+"""
+
+# the columns of the table "fish" the fish can be selected by and the type
+# the selected values are converted to
+SELECTION_COLUMNS = {'plate': str, 'substance': str, 'concentration': float,
+                     'hpf': str, 'replicate': str}
+
+
+# open the store, its tables are created if they don't exist yet
+def connect(path):
+    connection = sqlite3.connect(str(path))
+    connection.executescript(SCHEMA)
+
+    return connection
+
+
+# the replicate is the last part of the ID,
+# e.g. "R_1" in "3_Cadmiu5_96hpf_R_1"
+def replicate_from_id(fish_id):
+    return fish_id.split('_', 3)[3]
+
+
+# write all fish of the outlier script's output files of one plate into
+# a shard database. The shard is written from scratch, so fish removed as
+# outliers in the meantime disappear
+def write_shard(shard_path, plate, datafile_paths):
+    shard_path = pathlib.Path(shard_path)
+    if shard_path.exists():
+        shard_path.unlink()
+    connection = connect(shard_path)
+    with connection:
+        for datafile_path in datafile_paths:
+            df = ldt_io.read_csv(datafile_path, sep=',', header=0)
+            for well, fish in df.groupby('Individuum', sort=True):
+                first = fish.iloc[0]
+                connection.execute(
+                    "INSERT OR REPLACE INTO fish VALUES (?,?,?,?,?,?,?,?,?)",
+                    (plate, int(well), first['ID'], first['Substance'],
+                     float(first['Concentration']),
+                     first['Concentration_unit'], str(first['hpf']),
+                     replicate_from_id(first['ID']), len(fish)))
+                connection.execute(
+                    "INSERT OR REPLACE INTO series VALUES (?,?,?,?,?)",
+                    (plate, int(well),
+                     fish['Trial_time [s]'].to_numpy('float64').tobytes(),
+                     fish['Distance_moved [mm]'].to_numpy(
+                         'float64').tobytes(),
+                     fish['Light_on_off'].to_numpy('int8').tobytes()))
+    connection.close()
+
+    return shard_path
+
+
+# build the store of the campaign from the shards of all plates. The store
+# is written from scratch, so plates removed from the campaign disappear.
+# plates contains the key of every shard, e.g. its folder within the campaign
+def merge_shards(store_path, shard_paths, plates):
+    store_path = pathlib.Path(store_path)
+    if store_path.exists():
+        store_path.unlink()
+    connection = connect(store_path)
+    for shard_path, plate in zip(shard_paths, plates):
+        connection.execute("ATTACH DATABASE ? AS shard", (str(shard_path),))
+        with connection:
+            connection.execute(
+                "INSERT INTO fish SELECT ?, well, id, substance, "
+                "concentration, concentration_unit, hpf, replicate, "
+                "n_values FROM shard.fish", (plate,))
+            connection.execute(
+                "INSERT INTO series SELECT ?, well, trial_time, "
+                "distance_moved, light_on_off FROM shard.series", (plate,))
+        connection.execute("DETACH DATABASE shard")
+    connection.close()
+
+    return store_path
+
+
+# the metainformation of all fish in the store as dataframe
+def read_fish(store_path):
+    connection = connect(store_path)
+    fish = pd.read_sql_query("SELECT * FROM fish ORDER BY plate, well",
+                             connection)
+    connection.close()
+
+    return fish
+
+
+# the time series of one fish as dataframe in the format of the outlier
+# script's output
+def read_series(store_path, plate, well):
+    connection = connect(store_path)
+    row = connection.execute(
+        "SELECT trial_time, distance_moved, light_on_off FROM series "
+        "WHERE plate = ? AND well = ?", (plate, well)).fetchone()
+    connection.close()
+    if row is None:
+        raise KeyError(f"no fish in well {well} of plate {plate}")
+
+    return pd.DataFrame({
+        'Trial_time [s]': np.frombuffer(row[0], dtype='float64'),
+        'Distance_moved [mm]': np.frombuffer(row[1], dtype='float64'),
+        'Light_on_off': np.frombuffer(row[2], dtype='int8'),
+        })
+
+
+# translate a selection like {'substance': 'EtOH', 'concentration': [0, 5]}
+# into the WHERE clause of a query and its parameters. A single value
+# selects by equality, a list/tuple/set by membership, None is ignored
+def build_where_clause(selection):
+    clauses = []
+    parameters = []
+    for column, value in selection.items():
+        if column not in SELECTION_COLUMNS:
+            raise ValueError(f"fish can't be selected by {column}, only by "
+                             f"{', '.join(SELECTION_COLUMNS)}")
+        if value is None:
+            continue
+        if not isinstance(value, (list, tuple, set)):
+            value = [value]
+        values = [SELECTION_COLUMNS[column](item) for item in value]
+        clauses.append(f"fish.{column} IN ({', '.join('?' * len(values))})")
+        parameters.extend(values)
+    if not clauses:
+        return '', parameters
+
+    return ' WHERE ' + ' AND '.join(clauses), parameters
+
+
+# the metainformation of the fish matching the selection, e.g.
+#     select_fish(store_path, substance='EtOH', hpf=96)
+def select_fish(store_path, **selection):
+    where, parameters = build_where_clause(selection)
+    connection = connect(store_path)
+    fish = pd.read_sql_query(f"SELECT * FROM fish{where} "
+                             "ORDER BY plate, well", connection,
+                             params=parameters)
+    connection.close()
+
+    return fish
+
+
+# the labels of fish read from the store: their IDs, qualified with the plate
+# (e.g. "1_Cadmi0_96hpf_R_1@batch2/R_1") if an ID occurs on several plates,
+# so every fish keeps its own row or column. keys are (plate, well, ID)
+def fish_labels(keys):
+    counts = collections.Counter(fish_id for _, _, fish_id in keys)
+
+    return [f"{fish_id}@{plate}" if counts[fish_id] > 1 else fish_id
+            for plate, _, fish_id in keys]
+
+
+# the ID of a label of fish_labels, e.g. "1_Cadmi0_96hpf_R_1" for
+# "1_Cadmi0_96hpf_R_1@batch2/R_1"
+def id_from_label(label):
+    return str(label).split('@', 1)[0]
+
+
+# the distance moved of the given fish (rows of select_fish) in a
+# trialtime x fish format with the labels of fish_labels as header, like the
+# filtering script's format_dataframe. Only the series of these fish are
+# read
+def load_series(store_path, fish):
+    connection = connect(store_path)
+    columns = {}
+    for plate, well, fish_id in zip(fish['plate'], fish['well'], fish['id']):
+        trial_time, distance = connection.execute(
+            "SELECT trial_time, distance_moved FROM series "
+            "WHERE plate = ? AND well = ?", (plate, int(well))).fetchone()
+        columns[(plate, well, fish_id)] = pd.Series(
+            np.frombuffer(distance, dtype='float64'),
+            index=np.frombuffer(trial_time, dtype='float64'))
+    connection.close()
+    df = pd.DataFrame(columns)
+    # IDs may occur on several plates, thus the header is set afterwards
+    df.columns = fish_labels(columns)
+
+    return df
+
+
+# store the moving average/standard deviation (kind) of the fish in a
+# fish x timepoints format. keys contains (plate, well) of every row
+def write_filtered(store_path, keys, df, kind):
+    trial_time = df.columns.to_numpy('float64').tobytes()
+    connection = connect(store_path)
+    with connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO filtered VALUES (?,?,?,?,?)",
+            ((plate, int(well), kind, trial_time, values.tobytes())
+             for (plate, well), values in zip(keys,
+                                               df.to_numpy('float64'))))
+    connection.close()
+
+
+# the moving average/standard deviation (kind) of the given fish (rows of
+# select_fish) in a fish x timepoints format with the labels of fish_labels
+# as index, like the csv files of the filtering script. Fish without filtered
+# series are left out
+def load_filtered(store_path, fish, kind):
+    connection = connect(store_path)
+    rows = {}
+    for plate, well, fish_id in zip(fish['plate'], fish['well'], fish['id']):
+        row = connection.execute(
+            "SELECT trial_time, vals FROM filtered "
+            "WHERE plate = ? AND well = ? AND kind = ?",
+            (plate, int(well), kind)).fetchone()
+        if row is not None:
+            rows[(plate, well, fish_id)] = pd.Series(
+                np.frombuffer(row[1], dtype='float64'),
+                index=np.frombuffer(row[0], dtype='float64'))
+    connection.close()
+    df = pd.DataFrame(rows).T
+    df.index = fish_labels(rows)
+
+    return df
+
+
+# command line arguments of the scripts to select fish from a store
+def add_selection_arguments(parser):
+    parser.add_argument('--store', default=None,
+                        help="store of a campaign (Campaign_store.sqlite) "
+                             "to read the fish from")
+    parser.add_argument('--plate', nargs='+', default=None)
+    parser.add_argument('--substance', nargs='+', default=None)
+    parser.add_argument('--concentration', nargs='+', type=float,
+                        default=None)
+    parser.add_argument('--hpf', nargs='+', default=None)
+    parser.add_argument('--replicate', nargs='+', default=None)
+
+
+def selection_from_arguments(args):
+    return {column: getattr(args, column) for column in SELECTION_COLUMNS}
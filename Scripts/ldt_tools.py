@@ -0,0 +1,60 @@
+"""
+This module contains helper functions shared by the scripts
+established to analyse the output of the Light/Dark transition test.
+It allows to load the scripts (whose names contain '-' and thus cannot be
+imported directly) as modules and to fingerprint files, so the pipeline can
+tell whether a file changed since it was used the last time.
+It needs to be located in the same folder as the scripts.
+
+It was developed at the Computational Ecology working group,
+Institute for Environmental Research, Biology V, RWTH Aachen.
+
+For questions please contact: dominik.ziaja@rwth-aachen.de
+"""
+
+import importlib.util
+import hashlib
+import pathlib
+import sys
+
+
+# the folder all scripts are located in
+SCRIPT_FOLDER = pathlib.Path(__file__).resolve().parent
+
+
+# load a script like "Import-Script.py" as module "import_script", so its
+# functions can be called from other scripts. Each script is only loaded once
+def load_script(script_name):
+    script_path = SCRIPT_FOLDER / script_name
+    module_name = script_path.stem.replace('-', '_').lower()
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    spec = importlib.util.spec_from_file_location(module_name, script_path)
+    module = importlib.util.module_from_spec(spec)
+    # register the module before executing it, so e.g. multiprocessing
+    # can find the functions defined in it by the module name
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+
+    return module
+
+
+# the content hash of a (small) file, e.g. the source code of a script
+def hash_file(path):
+    with open(path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+# a cheap fingerprint of a (large) data file: name, size and time of the
+# last modification. Reading the whole file for a content hash would take
+# as long as processing it
+def file_fingerprint(path, relative_to=None):
+    path = pathlib.Path(path)
+    stat = path.stat()
+    if relative_to is not None:
+        name = path.resolve().relative_to(
+            pathlib.Path(relative_to).resolve()).as_posix()
+    else:
+        name = path.as_posix()
+
+    return [name, stat.st_size, stat.st_mtime_ns]